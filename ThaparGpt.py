@@ -141,7 +141,6 @@ class Mixtral:
     def __init__(self):
         load_dotenv()
         self.GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-        print(f"GROQ_API_KEY: {self.GROQ_API_KEY}")
         self.api_url = "https://api.groq.com/openai/v1/chat/completions"
         self.headers = {
             "Authorization": f"Bearer {self.GROQ_API_KEY}",
@@ -244,12 +243,13 @@ Then Provide answer:
         except Exception as e:
             return f"System error: {str(e)}"
 
-assistant = ThaparAssistant()
-# queries = [
-#         "What is program structure for MCA in Thapar"
-# ]
-query=input("Enter your query:")
+if __name__ == "__main__":
+    assistant = ThaparAssistant()
+    # queries = [
+    #         "What is program structure for MCA in Thapar"
+    # ]
+    query=input("Enter your query:")
 
-# for query in queries:
-print(f"\n{query}")
-print(f"\n{assistant.ask(query)}")
\ No newline at end of file
+    # for query in queries:
+    print(f"\n{query}")
+    print(f"\n{assistant.ask(query)}")
@@ -1,20 +1,75 @@
 import os
-import chromadb
-from chromadb import EmbeddingFunction
+import json
+import hashlib
+import logging
+import math
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+import numpy as np
 from dotenv import load_dotenv
 # from sentence_transformers import SentenceTransformer
 # import ollama
-from flask import Flask, request, jsonify   
+from flask import Flask, request, jsonify, Response, stream_with_context
 # from pyngrok import ngrok
 from flask_cors import CORS
-# import threading
-import cohere
+from werkzeug.middleware.proxy_fix import ProxyFix
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest
+from prometheus_client import Counter as MetricCounter
 
 
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; anything passed via `extra=` becomes a field
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+logger = logging.getLogger("thapargpt")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+STAGE_SECONDS = Histogram(
+    "thapar_stage_seconds", "Latency of each ask and populate_db stage", ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+STAGE_EVENTS = MetricCounter("thapar_stage_events_total", "Named events per stage (fast paths, retries, ...)", ["stage", "event"])
+CACHE_LOOKUPS = MetricCounter("thapar_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+UPSTREAM_ERRORS = MetricCounter("thapar_upstream_errors_total", "Failed calls to Cohere/Groq by error kind", ["upstream", "kind"])
+PROMPT_TOKENS = Histogram(
+    "thapar_prompt_tokens", "Estimated prompt tokens per LLM request",
+    buckets=(250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+)
+LLM_ACTIVE = Gauge("thapar_llm_active", "Generations holding an admission slot", multiprocess_mode="livesum")
+LLM_QUEUE_DEPTH = Gauge("thapar_llm_queue_depth", "Requests waiting for an admission slot", multiprocess_mode="livesum")
+SHED_REQUESTS = MetricCounter("thapar_shed_total", "Requests rejected by admission control", ["reason"])
+
 
 class DataLoader:
     def __init__(self):
-        self.data_dir = "Structured_Data"
+        self.data_dir = os.getenv("THAPAR_DATA_DIR", "Structured_Data")
     def load_files(self):
         data = {}
         for filename in os.listdir(self.data_dir):
@@ -24,118 +79,1170 @@ class DataLoader:
         return data
 
 
+def content_hash(txt):
+    return hashlib.sha256(txt.encode("utf-8")).hexdigest()
+
+
+def normalize_query(query):
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.rstrip("?.!").strip()
+
+
+class LRUCache:
+    # Bounded in-process cache with per-entry TTL; counts hits/misses for reporting
+    def __init__(self, max_size=1024, ttl=3600, name="lru"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and item[1] > time.monotonic():
+                self.data.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.labels(self.name, "hit").inc()
+                return item[0]
+            if item is not None:
+                del self.data[key]
+            self.misses += 1
+            CACHE_LOOKUPS.labels(self.name, "miss").inc()
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+class AnswerCache:
+    # Final answers keyed by normalized query, with a nearest-neighbour fallback over
+    # past query embeddings. Each entry remembers the chunk ids it was answered from,
+    # so it stops matching as soon as one of those chunks changes or is removed.
+    def __init__(self, max_size=1024, ttl=3600, threshold=0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.matrix = None
+        self.matrix_keys = []
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _valid(self, key, entry, known_chunks):
+        if entry["expires"] > time.monotonic() and all(cid in known_chunks for cid in entry["chunk_ids"]):
+            return True
+        del self.entries[key]
+        self.matrix = None
+        return False
+
+    def get(self, query, known_chunks):
+        key = normalize_query(query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._valid(key, entry, known_chunks):
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                CACHE_LOOKUPS.labels("answer", "exact_hit").inc()
+                return entry["answer"]
+            return None
+
+    def nearest(self, embedding, route, known_chunks):
+        query_vec = np.asarray(embedding, dtype=np.float32)
+        query_vec /= (np.linalg.norm(query_vec) or 1.0)
+        with self.lock:
+            if self.matrix is None:
+                # Answers from the lexical fast path have no embedding and only match exactly
+                self.matrix_keys = [k for k,entry in self.entries.items() if entry["embedding"] is not None]
+                if self.matrix_keys:
+                    self.matrix = np.stack([self.entries[k]["embedding"] for k in self.matrix_keys])
+            if self.matrix is not None:
+                if self.matrix.shape[1] == query_vec.shape[0]:
+                    scores = self.matrix @ query_vec
+                    for i in np.argsort(-scores):
+                        if scores[i] < self.threshold:
+                            break
+                        key = self.matrix_keys[i]
+                        entry = self.entries[key]
+                        if entry["route"] != route:
+                            continue
+                        if self._valid(key, entry, known_chunks):
+                            self.entries.move_to_end(key)
+                            self.semantic_hits += 1
+                            CACHE_LOOKUPS.labels("answer", "semantic_hit").inc()
+                            return entry["answer"]
+                        break
+            self.misses += 1
+            CACHE_LOOKUPS.labels("answer", "miss").inc()
+            return None
+
+    def put(self, query, route, embedding, answer, chunk_ids):
+        key = normalize_query(query)
+        vec = None
+        if embedding is not None:
+            vec = np.asarray(embedding, dtype=np.float32)
+            vec /= (np.linalg.norm(vec) or 1.0)
+        with self.lock:
+            self.entries[key] = {
+                "route": route,
+                "embedding": vec,
+                "answer": answer,
+                "chunk_ids": list(chunk_ids),
+                "expires": time.monotonic() + self.ttl
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.matrix = None
+
+    def stats(self):
+        with self.lock:
+            total = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / total, 4) if total else 0.0
+            }
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution; nothing is kept once it finishes
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["event"].set()
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.calls), "leaders": self.leaders, "coalesced": self.followers}
+
+
+class CallStats:
+    # Rolling latency window plus named counters for one stage or upstream dependency;
+    # a named instance also feeds the Prometheus stage histogram and event counter
+    def __init__(self, name=None, window=500):
+        self.name = name
+        self.latencies = deque(maxlen=window)
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+        if self.name:
+            STAGE_SECONDS.labels(self.name).observe(seconds)
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        if self.name:
+            STAGE_EVENTS.labels(self.name, name).inc(n)
+
+    @contextmanager
+    def timer(self):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_latency(time.monotonic() - start)
+
+    def percentile(self, pct, min_samples=20):
+        with self.lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def snapshot(self):
+        latency = {}
+        for pct in (50, 95, 99):
+            value = self.percentile(pct, min_samples=1)
+            latency[f"p{pct}_ms"] = round(value * 1000, 1) if value is not None else None
+        with self.lock:
+            return {"latency": latency, "counters": dict(self.counters)}
+
+
+STOPWORDS = {
+    "a","an","and","are","at","be","by","do","does","for","from","how","i","in","is","it","me",
+    "much","my","of","on","or","tell","the","to","what","when","where","which","who","with","about"
+}
+
+def tokenize(txt):
+    return [tok for tok in re.findall(r"[a-z0-9]+", txt.lower()) if tok not in STOPWORDS]
+
+
+class BM25Index:
+    # In-process inverted index over the same chunk ids as the vector store
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self.postings = {}
+        self.total_len = 0
+        self.lock = threading.RLock()
+
+    def add(self, chunk_id, txt, collection):
+        with self.lock:
+            if chunk_id in self.docs:
+                return
+            tf = Counter(tokenize(txt))
+            self.docs[chunk_id] = {"text": txt, "collection": collection, "len": sum(tf.values())}
+            self.total_len += self.docs[chunk_id]["len"]
+            for term,count in tf.items():
+                self.postings.setdefault(term, {})[chunk_id] = count
+
+    def remove(self, chunk_id):
+        with self.lock:
+            doc = self.docs.pop(chunk_id, None)
+            if doc is None:
+                return
+            self.total_len -= doc["len"]
+            for term in set(tokenize(doc["text"])):
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(chunk_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def sync(self, texts, manifest):
+        # Incremental rebuild: only chunks that appeared or disappeared are touched
+        with self.lock:
+            for chunk_id in [cid for cid in self.docs if cid not in texts]:
+                self.remove(chunk_id)
+            for chunk_id,txt in texts.items():
+                self.add(chunk_id, txt, manifest[chunk_id]["collection"])
+
+    def search(self, query, top_k=10):
+        with self.lock:
+            if not self.docs:
+                return []
+            n_docs = len(self.docs)
+            avg_len = self.total_len / n_docs
+            scores = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = np.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id,count in posting.items():
+                    norm = count + self.k1 * (1 - self.b + self.b * self.docs[chunk_id]["len"] / avg_len)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (self.k1 + 1) / norm
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def idf(self, term):
+        with self.lock:
+            n_docs = len(self.docs)
+            df = len(self.postings.get(term, ()))
+        return float(np.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+
+    def text(self, chunk_id):
+        return self.docs[chunk_id]["text"]
+
+    def collection(self, chunk_id):
+        return self.docs[chunk_id]["collection"]
+
+
+class EmbeddingCache:
+    # Disk-backed embedding cache keyed by (model, input_type, text hash), evicted LRU by size
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def key(self, model, input_type, txt):
+        return f"{model}:{input_type}:{content_hash(txt)}"
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(set(keys))
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i+500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?'*len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            CACHE_LOOKUPS.labels("embedding_disk", "hit").inc(len(found))
+            CACHE_LOOKUPS.labels("embedding_disk", "miss").inc(len(keys) - len(found))
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?", [(now, k) for k in found])
+                self.conn.commit()
+        return found
+
+    def put_many(self, vectors):
+        if not vectors:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in vectors.items():
+            blob = array('f', vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?,?,?,?)", rows)
+            self.conn.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size),0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the limit so we don't evict on every insert once full
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in self.conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self.conn.executemany("DELETE FROM embeddings WHERE key=?", victims)
+        self.conn.commit()
+
+
+class CohereEmbedder:
+    # Hosted embed-english-v3.0; Cohere accepts at most 96 texts per embed request
+    name = "cohere"
+    batch_size = 96
+
+    def __init__(self, api_key, model_name="embed-english-v3.0"):
+        self.model_name = model_name
+        self.model_id = f"cohere/{model_name}"
+        import cohere
+        self.client = cohere.Client(api_key)
+        self.stats = CallStats("cohere_embed")
+
+    def embed_batch(self, texts, input_type):
+        with self.stats.timer():
+            response = self.client.embed(
+                texts=texts,
+                model=self.model_name,
+                input_type=input_type  # Required for this model
+            )
+        self.stats.incr("texts", len(texts))
+        return response.embeddings
+
+
+class OnnxEmbedder:
+    # Local CPU encoder from a directory holding an ONNX export (int8 model_quantized.onnx is
+    # preferred over model.onnx) and its tokenizer.json. Mean pooled, normalized vectors.
+    # Nothing is imported or loaded until the first embed; one session serves every thread.
+    name = "onnx"
+    batch_size = 32
+
+    def __init__(self, model_dir, model_id=None, max_length=512):
+        self.model_dir = model_dir
+        self.model_id = model_id or f"onnx/{os.path.basename(os.path.normpath(model_dir))}"
+        self.max_length = max_length
+        # e5 style instructions; set both to "" for models trained without them
+        self.prefixes = {
+            "search_query": os.getenv("EMBED_QUERY_PREFIX", "query: "),
+            "search_document": os.getenv("EMBED_DOCUMENT_PREFIX", "passage: ")
+        }
+        self.threads = int(os.getenv("EMBED_ONNX_THREADS", "1"))
+        self.session = None
+        self.lock = threading.Lock()
+        self.stats = CallStats("local_embed")
+
+    def _load(self):
+        with self.lock:
+            if self.session is None:
+                import onnxruntime
+                from tokenizers import Tokenizer
+                candidates = [os.path.join(self.model_dir, name) for name in ("model_quantized.onnx", "model.onnx")]
+                path = next((c for c in candidates if os.path.exists(c)), None)
+                if path is None:
+                    raise FileNotFoundError(f"No model_quantized.onnx or model.onnx in {self.model_dir}")
+                tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+                tokenizer.enable_truncation(self.max_length)
+                tokenizer.enable_padding()
+                options = onnxruntime.SessionOptions()
+                # Parallelism comes from EmbeddingModel's batch threads, not from inside one run
+                options.intra_op_num_threads = self.threads
+                session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+                self.input_names = {i.name for i in session.get_inputs()}
+                self.tokenizer = tokenizer
+                self.session = session
+                logger.info("Loaded local embedding model", extra={"model": self.model_id, "path": path})
+        return self.session
+
+    def embed_batch(self, texts, input_type):
+        session = self.session or self._load()
+        with self.stats.timer():
+            encodings = self.tokenizer.encode_batch([self.prefixes.get(input_type, "") + t for t in texts])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": mask, "token_type_ids": np.zeros_like(input_ids)}
+            hidden = session.run(None, {k:v for k,v in feeds.items() if k in self.input_names})[0]
+            if hidden.ndim == 3:
+                weights = mask[..., None].astype(np.float32)
+                hidden = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            hidden /= np.linalg.norm(hidden, axis=1, keepdims=True) + 1e-12
+        self.stats.incr("texts", len(texts))
+        return hidden.tolist()
+
+
 class EmbeddingModel:
     def __init__(self):
         load_dotenv()
         self.api_key = os.getenv("COHERE_API_KEY")
-        self.use_cohere = self.api_key is not None
-        self.cohere_client = None
-        
-        if self.use_cohere:
-            try:
-                self.cohere_client = cohere.Client(self.api_key)
-                # Test the API to ensure it's working
-                self.cohere_client.embed(texts=["test"], model="embed-english-v3.0",input_type="search_document")
-                print("[EmbeddingModel] Using Cohere API for embeddings.")
-            except Exception as e:
-                print(f"[EmbeddingModel] Failed to use Cohere API. Falling back to local model. Reason: {str(e)}")
-                self._load_local_model()
+        # Vectors from different models never share an index: VectorDB records model_id and
+        # dimension in its manifest and refuses an index built with another model
+        backend = os.getenv("EMBED_BACKEND") or ("cohere" if self.api_key else "onnx")
+        if backend == "cohere":
+            if not self.api_key:
+                raise RuntimeError("EMBED_BACKEND=cohere needs COHERE_API_KEY")
+            self.backend = CohereEmbedder(self.api_key)
+        elif backend == "onnx":
+            self.backend = OnnxEmbedder(
+                os.getenv("EMBED_ONNX_DIR", "models/e5-small-v2-int8"), model_id=os.getenv("EMBED_MODEL_ID")
+            )
         else:
-            print("[EmbeddingModel] COHERE_API_KEY not found. Using local model.")
-            self._load_local_model()
+            raise ValueError(f"Unknown EMBED_BACKEND {backend!r}")
+        self.model_id = self.backend.model_id
+        self.batch_size = int(os.getenv("EMBED_BATCH_SIZE", str(self.backend.batch_size)))
+        self.max_workers = int(os.getenv("EMBED_CONCURRENCY", "4"))
+        self.cache = EmbeddingCache(
+            os.getenv("EMBED_CACHE_PATH", os.path.join(os.getenv("THAPAR_INDEX_DIR", ".chroma"), "embed_cache.sqlite")),
+            max_bytes=int(float(os.getenv("EMBED_CACHE_MAX_MB", "256")) * 1024 * 1024)
+        )
+        self.query_cache = LRUCache(
+            max_size=int(os.getenv("QUERY_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("QUERY_CACHE_TTL", "3600")),
+            name="query_embedding"
+        )
+        self.embed_stats = self.backend.stats
+        logger.info("Embedding backend selected", extra={"model": self.model_id})
 
-    def _load_local_model(self):
-        self.use_cohere = False
-        self.local_model = SentenceTransformer("intfloat/e5-small-v2")
+    def _embed_cached(self, txt, input_type):
+        keys = [self.cache.key(self.model_id, input_type, t) for t in txt]
+        found = self.cache.get_many(keys)
+        missing = {}
+        for key, t in zip(keys, txt):
+            if key not in found:
+                missing.setdefault(key, t)
+        
+        if missing:
+            items = list(missing.items())
+            batches = [items[i:i+self.batch_size] for i in range(0, len(items), self.batch_size)]
+            def run(batch):
+                return batch, self.backend.embed_batch([t for _, t in batch], input_type)
+            if len(batches) == 1:
+                results = [run(batches[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+                    results = list(pool.map(run, batches))
+            fresh = {}
+            for batch, vectors in results:
+                for (key, _), vector in zip(batch, vectors):
+                    fresh[key] = list(vector)
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        return [found[key] for key in keys]
 
-    def embed(self, txt):
+    def embed(self, txt, input_type="search_document"):
+        if isinstance(txt, str):
+            txt = [txt]
         try:
-            print("[EmbeddingModel] Using Cohere API for embeddings.")
-            if isinstance(txt, str):
-                txt = [txt]
-            response = self.cohere_client.embed(
-                texts=txt,
-                model="embed-english-v3.0",
-                input_type="search_document"  # Required for this model
-            )
-            return response.embeddings
+            return self._embed_cached(txt, input_type)
         except Exception as e:
-            print(f"[EmbeddingModel] Error during embedding. Fallback to local. Error: {e}")
-        
-        # Lazy load local model
-        if not hasattr(self, "local_model"):
-            from sentence_transformers import SentenceTransformer
-            self.local_model = SentenceTransformer("all-MiniLM-L6-v2")
-        return self.local_model.encode(txt)
+            # No fallback to another model: its vectors would not be comparable with the index
+            UPSTREAM_ERRORS.labels(self.backend.name, type(e).__name__).inc()
+            raise
+
+    def embed_query(self, query):
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries):
+        # Cached vectors first; every miss goes out in one embed call (split only by batch_size)
+        keys = [normalize_query(query) for query in queries]
+        found = {}
+        missing = {}
+        for key,query in zip(keys, queries):
+            if key not in found:
+                found[key] = self.query_cache.get(key)
+                if found[key] is None:
+                    missing[key] = query
+        if missing:
+            for key,embedding in zip(missing, self.embed(list(missing.values()), input_type="search_query")):
+                found[key] = list(embedding)
+                self.query_cache.put(key, found[key])
+        return [found[key] for key in keys]
+
+class NumpyCollection:
+    # Exact search over one contiguous matrix of unit vectors; implements the slice of the
+    # chromadb collection API that VectorDB uses (count/get/upsert/delete/query)
+    def __init__(self, name, dtype="float32", matrix=None, ids=None, documents=None, metadatas=None):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.Lock()
+        # Swapped as one tuple on every write, so a concurrent query never sees half an update
+        self.data = (
+            matrix if matrix is not None else np.zeros((0, 0), dtype=self.dtype),
+            list(ids or []), list(documents or []), list(metadatas or [])
+        )
+
+    def count(self):
+        return len(self.data[1])
+
+    def get(self, include=("documents", "metadatas")):
+        matrix, ids, documents, metadatas = self.data
+        result = {"ids": list(ids)}
+        if "embeddings" in include:
+            result["embeddings"] = np.array(matrix, dtype=np.float32)
+        if "documents" in include:
+            result["documents"] = list(documents)
+        if "metadatas" in include:
+            result["metadatas"] = list(metadatas)
+        return result
+
+    def upsert(self, ids, embeddings, documents, metadatas=None):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        metadatas = metadatas or [{}] * len(ids)
+        with self.lock:
+            matrix, old_ids, old_docs, old_meta = self.data
+            rows = {cid:i for i,cid in enumerate(old_ids)}
+            new_ids, new_docs, new_meta = list(old_ids), list(old_docs), list(old_meta)
+            # Copy: the current matrix may be a read-only memory map shared with other readers
+            if not len(old_ids):
+                matrix = np.zeros((0, vectors.shape[1]), dtype=self.dtype)
+            elif matrix.shape[1] != vectors.shape[1]:
+                raise ValueError(f"{self.name}: got {vectors.shape[1]}-d vectors for a {matrix.shape[1]}-d collection")
+            else:
+                matrix = np.array(matrix, dtype=self.dtype)
+            appended = []
+            for cid,vector,doc,md in zip(ids, vectors, documents, metadatas):
+                if cid in rows:
+                    matrix[rows[cid]] = vector
+                    new_docs[rows[cid]] = doc
+                    new_meta[rows[cid]] = md
+                else:
+                    rows[cid] = len(new_ids)
+                    new_ids.append(cid)
+                    new_docs.append(doc)
+                    new_meta.append(md)
+                    appended.append(vector)
+            if appended:
+                matrix = np.vstack([matrix, np.asarray(appended, dtype=self.dtype)])
+            self.data = (np.ascontiguousarray(matrix), new_ids, new_docs, new_meta)
+
+    def delete(self, ids):
+        drop = set(ids)
+        with self.lock:
+            matrix, old_ids, old_docs, old_meta = self.data
+            keep = [i for i,cid in enumerate(old_ids) if cid not in drop]
+            self.data = (
+                np.ascontiguousarray(matrix[keep]) if len(old_ids) else matrix,
+                [old_ids[i] for i in keep], [old_docs[i] for i in keep], [old_meta[i] for i in keep]
+            )
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        # Every query in the batch is scored with one matrix multiply; distance is 1 - cosine
+        matrix, ids, documents, metadatas = self.data
+        if where:
+            rows = [i for i,md in enumerate(metadatas) if metadata_matches(md, where)]
+            matrix = matrix[rows] if rows else matrix[:0]
+            ids, documents, metadatas = [ids[i] for i in rows], [documents[i] for i in rows], [metadatas[i] for i in rows]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        k = min(n_results, len(ids))
+        if k == 0:
+            for key in result:
+                result[key] = [[] for _ in range(len(queries))]
+            return result
+        scores = queries @ matrix.T if matrix.dtype == np.float32 else queries @ matrix.T.astype(np.float32)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row,candidates in zip(scores, top):
+            order = candidates[np.argsort(-row[candidates])]
+            result["ids"].append([ids[i] for i in order])
+            result["documents"].append([documents[i] for i in order])
+            result["metadatas"].append([metadatas[i] for i in order])
+            result["distances"].append([float(1.0 - row[i]) for i in order])
+        return result
+
+
+class NumpyVectorStore:
+    # All collections in one file: magic, header length, JSON header (ids, documents, metadata,
+    # matrix offsets), then each matrix 64-byte aligned so it can be memory mapped read-only
+    MAGIC = b"THAPARVS1\n"
+    ALIGN = 64
+
+    def __init__(self, path, dtype="float32"):
+        self.path = path
+        self.dtype = dtype
+        self.collections = {}
+        if os.path.exists(path):
+            self.load()
+
+    def get_or_create_collection(self, name):
+        if name not in self.collections:
+            self.collections[name] = NumpyCollection(name, self.dtype)
+        return self.collections[name]
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f"{self.path} is not a vector store file")
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        data_start = self._align(len(self.MAGIC) + 8 + header_len)
+        for name,entry in header["collections"].items():
+            rows, dim = entry["rows"], entry["dim"]
+            if rows:
+                matrix = np.memmap(self.path, dtype=entry["dtype"], mode="r", offset=data_start + entry["offset"], shape=(rows, dim))
+            else:
+                matrix = np.zeros((0, dim), dtype=entry["dtype"])
+            self.collections[name] = NumpyCollection(
+                name, entry["dtype"], matrix, entry["ids"], entry["documents"], entry["metadatas"]
+            )
+
+    def save(self):
+        entries, blocks, offset = {}, [], 0
+        for name,collection in self.collections.items():
+            matrix, ids, documents, metadatas = collection.data
+            matrix = np.ascontiguousarray(matrix, dtype=collection.dtype)
+            entries[name] = {
+                "dtype": collection.dtype.name, "rows": len(ids), "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                "offset": offset, "ids": ids, "documents": documents, "metadatas": metadatas
+            }
+            blocks.append(matrix)
+            offset = self._align(offset + matrix.nbytes)
+        header = json.dumps({"collections": entries}).encode("utf-8")
+        data_start = self._align(len(self.MAGIC) + 8 + len(header))
+        # Written beside the old file and renamed, so existing memory maps keep their data
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(self.MAGIC + len(header).to_bytes(8, "little") + header)
+            for entry,matrix in zip(entries.values(), blocks):
+                f.seek(data_start + entry["offset"])
+                f.write(matrix.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def _align(self, n):
+        return -(-n // self.ALIGN) * self.ALIGN
+
 
 class VectorDB(DataLoader):
-    def __init__(self):
+    def __init__(self, progress=None):
         super().__init__()
-        self.client = chromadb.Client()
+        # progress(phase, **info) is called as start-up moves along; used for readiness reporting
+        self.progress = progress or (lambda phase, **info: None)
+        self.progress("embedder")
+        # Vectors live on disk so a restart only re-embeds chunks whose content changed
+        self.index_dir = os.getenv("THAPAR_INDEX_DIR", ".chroma")
+        self.manifest_path = os.path.join(self.index_dir, "manifest.json")
+        # "numpy" keeps each collection as one exact-search matrix in a single mmap-able file
+        self.backend = os.getenv("VECTOR_BACKEND", "chroma").lower()
+        # Records longer than this (estimated tokens) are split into titled sub-chunks
+        self.chunk_max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", "128"))
+        # Set for gunicorn workers: the index was built before forking and is only read here
+        self.read_only = os.getenv("THAPAR_INDEX_READONLY", "0") == "1"
+        if self.backend == "numpy":
+            os.makedirs(self.index_dir, exist_ok=True)
+            self.client = NumpyVectorStore(
+                os.path.join(self.index_dir, "vectors.bin"), dtype=os.getenv("VECTOR_DTYPE", "float32")
+            )
+        else:
+            import chromadb
+            self.client = chromadb.PersistentClient(path=self.index_dir)
         self.embedder = EmbeddingModel()
+        self.progress("index", backend=self.backend)
         self.collections = {}
-        for collection_name in ["thapar_hostels", "thapar_academics", "thapar_activities","thapar_placements","thapar_fee","thapar_syllabus"]:
-            try:
-                self.client.delete_collection(collection_name)
-            except:
-                pass
-        self.incollections()   
+        self.incollections()
+        self.manifest = self.load_manifest()
+        self.centroids = {}
+        self.collection_sizes = {}
+        self.lexical = BM25Index()
+        self.populate_stats = {name: CallStats(f"populate_{name}") for name in ("load", "embed", "upsert", "index", "total")}
+        self.search_pool = ThreadPoolExecutor(max_workers=len(self.collections))
     def incollections(self):
         
+        # File names as written by ingest.py; collectionForFile does the actual routing
         file_types = {
-          "hostels":["Hostel_info.txt"],
+          "hostels":["Hostel_info.txt","Hostel_fees.txt"],
           "activities":["TIET_Events.txt","clubs_thapar.txt","Thapar_Societies.txt"],
           "academics":["scholarships.txt"],
           "fee":["course_fee.txt"],
-          "syllabus":["pg_program_structure.txt"],
-          "placements":["Placement_Record.txt"],
-          "fee":["programme_fees_structured.txt"]
+          "syllabus":["Pg_Program_Structure.txt"],
+          "placements":["Placement_Record.txt"]
         }
         
         for col_type,files in file_types.items():
             col_name = f"thapar_{col_type}"
-            self.collections[col_type] = self.client.create_collection(name=col_name)
-    def chunkData(self,txt,delimiter = "###"):
-        return [chunk.strip() for chunk in txt.split(delimiter) if chunk.strip()]
+            self.collections[col_type] = self.client.get_or_create_collection(name=col_name)
+    def load_manifest(self):
+        # manifest maps chunk id -> {"hash", "collection", "source", "title", "fields"} for every vector on disk,
+        # plus the embedding model and dimension the vectors were built with
+        self.index_dimension = None
+        try:
+            with open(self.manifest_path,'r',encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        chunks = manifest.get("chunks",{})
+        # Indexes written before the model was recorded were all built with Cohere
+        embedding = manifest.get("embedding", {"model": "cohere/embed-english-v3.0"})
+        if chunks and embedding["model"] != self.embedder.model_id:
+            raise RuntimeError(
+                f"Index in {self.index_dir} was built with {embedding['model']} but the embedder is "
+                f"{self.embedder.model_id}; point THAPAR_INDEX_DIR elsewhere or delete it to rebuild"
+            )
+        self.index_dimension = embedding.get("dimension")
+        # Drop entries for collections whose vectors are gone (e.g. index dir partially wiped)
+        for col_type,collection in self.collections.items():
+            expected = sum(1 for entry in chunks.values() if entry["collection"] == col_type)
+            if expected != collection.count():
+                chunks = {cid:entry for cid,entry in chunks.items() if entry["collection"] != col_type}
+                if self.read_only:
+                    # Workers never write the shared store: keep its vectors, just forget the entries here
+                    logger.warning("Manifest out of sync, skipping collection", extra={"collection": col_type})
+                    continue
+                logger.warning("Manifest out of sync, rebuilding collection", extra={"collection": col_type})
+                existing = collection.get()["ids"]
+                if existing:
+                    collection.delete(ids=existing)
+        return chunks
+    def save_manifest(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path,'w',encoding="utf-8") as f:
+            json.dump({
+                "embedding":{"model":self.embedder.model_id,"dimension":self.index_dimension},
+                "chunks":self.manifest
+            }, f)
+        os.replace(tmp_path, self.manifest_path)
+    def chunkData(self,txt):
+        return chunk_records(txt, self.chunk_max_tokens)
+    def chunkMetadata(self,entry):
+        # Vector store metadata must be scalars: "field" is set when the chunk covers exactly one
+        # top-level field (the usual case for pieces of a split record), "" otherwise
+        fields = entry["fields"]
+        return {"source":entry["source"],"title":entry["title"],"field":fields[0] if len(fields) == 1 else ""}
+    def collectionForFile(self,filename):
+        if 'hostel' in filename.lower():
+            return "hostels"
+        elif 'scholarship' in filename.lower(): 
+            return "academics"
+        elif "placement" in filename.lower():
+            return "placements"
+        elif "fee" in filename.lower():
+            return "fee"
+        elif "_structure" in filename.lower():
+            return "syllabus"
+        else:
+            return "activities"
     def  populate_db(self):
-        files_data = self.load_files()
-        
-        for filename,content in files_data.items():
-            if 'hostel' in filename.lower():
-                col_type ="hostels"
-            elif 'scholarship' in filename.lower(): 
-                col_type = "academics"
-            elif "placement" in filename.lower():
-                col_type ="placements"
-            elif "fee" in filename.lower():
-                col_type = "fee"
-            elif "_structure" in filename.lower():
-                col_type = "syllabus"
-            else:
-                col_type = "activities"
+        stats = self.populate_stats
+        with stats["total"].timer():
+            self.progress("load")
+            with stats["load"].timer():
+                files_data = self.load_files()
+                current = {}
+                texts = {}
+                pending = {}
+                
+                for filename,content in files_data.items():
+                    col_type = self.collectionForFile(filename)
+                    
+                    # Chunk ids are content addressed, so only new or edited chunks need embedding
+                    for chunk in self.chunkData(content):
+                        chunk_sha = content_hash(chunk["text"])
+                        chunk_id = f"{filename}_{chunk_sha[:16]}"
+                        current[chunk_id] = {
+                            "hash":chunk_sha,"collection":col_type,"source":filename,
+                            "title":chunk["title"],"fields":chunk["fields"]
+                        }
+                        texts[chunk_id] = chunk["text"]
+                        if self.manifest.get(chunk_id) != current[chunk_id]:
+                            pending[chunk_id] = chunk["text"]
+            
+            if self.read_only and pending:
+                # Never embed or write from a worker; serve what the build step indexed
+                logger.warning("Index is stale, serving it without new chunks", extra={"missing": len(pending)})
+                current = {cid:entry for cid,entry in current.items() if cid not in pending}
+                texts = {cid:txt for cid,txt in texts.items() if cid in current}
+                pending = {}
+            
+            # Embed every pending chunk in one call so batching and concurrency span all files
+            added = len(pending)
+            if pending:
+                self.progress("embed", chunks=added)
+                with stats["embed"].timer():
+                    embeddings = self.embedder.embed(list(pending.values()))
+                self.check_dimension(embeddings)
+                with stats["upsert"].timer():
+                    by_collection = {}
+                    for chunk_id,embedding in zip(pending, embeddings):
+                        by_collection.setdefault(current[chunk_id]["collection"], []).append((chunk_id, embedding))
+                    for col_type,items in by_collection.items():
+                        self.collections[col_type].upsert(
+                            documents = [pending[cid] for cid,_ in items],
+                            embeddings = [list(emb) for _,emb in items],
+                            ids = [cid for cid,_ in items],
+                            metadatas =[self.chunkMetadata(current[cid]) for cid,_ in items]
+                        )
             
-            chunks = self.chunkData(content)
-            embeddings = self.embedder.embed(chunks)
-            self.collections[col_type].add(
-                documents = chunks,
-                embeddings = embeddings,
-                ids = [f"{filename}_{i}" for i in range(len(chunks))],
-                metadatas =[{"source":filename}]*len(chunks)
+            stale = {}
+            for chunk_id,entry in self.manifest.items():
+                if not self.read_only and current.get(chunk_id, {}).get("collection") != entry["collection"]:
+                    stale.setdefault(entry["collection"], []).append(chunk_id)
+            for col_type,ids in stale.items():
+                self.collections[col_type].delete(ids=ids)
+            
+            if not self.read_only and (added or stale or current.keys() != self.manifest.keys()):
+                if self.backend == "numpy":
+                    self.client.save()
+                self.manifest = current
+                self.save_manifest()
+            self.progress("lexical", chunks=len(current))
+            with stats["index"].timer():
+                self.lexical.sync(texts, current)
+                self.refresh_centroids()
+        stats["total"].incr("chunks_embedded", added)
+        logger.info("Index ready", extra={
+            "chunks": len(current),
+            "embedded": added,
+            "removed": sum(map(len, stale.values())),
+            "seconds": round(stats["total"].latencies[-1], 3)
+        })
+    
+    def refresh_centroids(self):
+        # Normalized mean vector of each collection, used to route queries without extra embed calls
+        centroids = {}
+        sizes = {}
+        for col_type,collection in self.collections.items():
+            embeddings = collection.get(include=["embeddings"])["embeddings"]
+            sizes[col_type] = 0 if embeddings is None else len(embeddings)
+            if sizes[col_type] == 0:
+                continue
+            centroid = np.asarray(embeddings, dtype=np.float32)
+            centroid /= np.linalg.norm(centroid, axis=1, keepdims=True) + 1e-12
+            centroid = centroid.mean(axis=0)
+            centroids[col_type] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.centroids = centroids
+        self.collection_sizes = sizes
+    
+    def route_scores(self, query_embedding):
+        if not self.centroids:
+            return []
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_vec /= (np.linalg.norm(query_vec) or 1.0)
+        scores = [(col_type, float(centroid @ query_vec)) for col_type,centroid in self.centroids.items()]
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+    
+    def search(self, query_embedding, collection_types, top_k=3, where=None):
+        return self.search_many([query_embedding], [collection_types], top_k, where)[0]
+
+    def check_dimension(self, embeddings):
+        dimensions = {len(embedding) for embedding in embeddings}
+        if self.index_dimension is not None:
+            dimensions.add(self.index_dimension)
+        if len(dimensions) > 1:
+            raise ValueError(f"Embedding dimensions {sorted(dimensions)} do not match the index ({self.embedder.model_id})")
+        if dimensions:
+            self.index_dimension = dimensions.pop()
+
+    def search_many(self, query_embeddings, collection_types, top_k=3, where=None):
+        # collection_types[i] lists the collections for query i. Each collection is queried once
+        # with every query routed to it (in parallel across collections), then each query's hits
+        # are merged into one global top-k by distance. `where` filters on chunk metadata
+        # (source, title, field) with chromadb's syntax.
+        self.check_dimension(query_embeddings)
+        routed = {}
+        for i,col_types in enumerate(collection_types):
+            for col_type in col_types:
+                routed.setdefault(col_type, []).append(i)
+
+        def search_one(col_type):
+            rows = routed[col_type]
+            n_results = min(top_k, self.collection_sizes.get(col_type, top_k))
+            if n_results == 0:
+                return []
+            results = self.collections[col_type].query(
+                query_embeddings = [query_embeddings[i] for i in rows],
+                n_results = n_results,
+                where = where
             )
+            return [
+                (i, list(zip(results["distances"][j], results["ids"][j], results["documents"][j])))
+                for j,i in enumerate(rows)
+            ]
+        if len(routed) == 1:
+            parts = [search_one(col_type) for col_type in routed]
+        else:
+            parts = self.search_pool.map(search_one, routed)
+        hits = [[] for _ in query_embeddings]
+        for part in parts:
+            for i,part_hits in part:
+                hits[i] += part_hits
+        merged = []
+        for query_hits in hits:
+            query_hits = sorted(query_hits, key=lambda hit: hit[0])[:top_k]
+            merged.append(([doc for _,_,doc in query_hits], [cid for _,cid,_ in query_hits]))
+        return merged
     
-    def query(self,query,collection_type,top_k=3):
+    def query(self,query,collection_type,top_k=3,with_ids=False,where=None):
         try:
-            query_embeddings = self.embedder.embed([query])
+            query_embedding = self.embedder.embed_query(query)
             results = self.collections[collection_type].query(
-                query_embeddings = query_embeddings,
-                n_results = top_k
+                query_embeddings = [query_embedding],
+                n_results = top_k,
+                where = where
             )
+            if with_ids:
+                return results["documents"][0], results["ids"][0]
             return results["documents"][0]
-        except Exception as e:
-            print(f"\nQuery Errors:{str(e)}")
+        except Exception:
+            logger.exception("Query failed", extra={"collection": collection_type})
             raise
 
 import requests
+from requests.adapters import HTTPAdapter
+
+class CircuitBreaker:
+    # closed -> open after `threshold` consecutive failures; one probe allowed after `reset_timeout`
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_thread = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.probing = True
+                self.probe_thread = threading.get_ident()
+                return True
+            return False
+
+    def release(self):
+        # A probe that ended without an upstream verdict (e.g. our own deadline) frees the slot
+        # for the next caller instead of leaving the breaker stuck half-open
+        with self.lock:
+            if self.probing and self.probe_thread == threading.get_ident():
+                self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self.probing else "open"
+
+
+class RetryableHTTPError(requests.HTTPError):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    # The caller's time budget ran out before the upstream answered
+    pass
+
+
+class Overloaded(Exception):
+    # Raised instead of queueing forever; the API turns it into a 503 (or 429) with Retry-After
+    status = 503
+
+    def __init__(self, message, retry_after=1, reason=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RateLimited(Overloaded):
+    status = 429
+
+
+class AdmissionController:
+    # At most `max_active` generations run at once; up to `max_queue` more wait, each until its
+    # deadline. Anything beyond that is shed immediately rather than piling onto the upstream.
+    def __init__(self, max_active=8, max_queue=32, timeout=5.0):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "deadline": 0}
+        self.cond = threading.Condition()
+
+    def _shed(self, reason, message):
+        self.shed[reason] += 1
+        SHED_REQUESTS.labels(reason).inc()
+        raise Overloaded(message, retry_after=max(1, math.ceil(self.timeout)), reason=reason)
+
+    def acquire(self, deadline=None):
+        # Never wait longer than `timeout`, even when the caller's own deadline is further out
+        deadline = min(d for d in (deadline, time.monotonic() + self.timeout) if d is not None)
+        with self.cond:
+            if self.active < self.max_active and self.waiting == 0:
+                self.active += 1
+            else:
+                if self.waiting >= self.max_queue:
+                    self._shed("queue_full", "Too many questions in flight, please retry shortly")
+                self.waiting += 1
+                LLM_QUEUE_DEPTH.inc()
+                try:
+                    while self.active >= self.max_active:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed("deadline", "Timed out waiting for a free answer slot")
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    LLM_QUEUE_DEPTH.dec()
+                self.active += 1
+            self.admitted += 1
+        LLM_ACTIVE.inc()
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+        LLM_ACTIVE.dec()
+
+    @contextmanager
+    def slot(self, deadline=None):
+        self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "active": self.active,
+                "waiting": self.waiting,
+                "max_active": self.max_active,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "shed": dict(self.shed)
+            }
+
+
+class RateLimiter:
+    # Token bucket per client: `rate` tokens per second up to `burst`; least recently seen
+    # clients are forgotten beyond `max_clients`. A request costing more than `burst` (a big
+    # batch) needs a full bucket and leaves it in debt for the rest, so it is charged in full.
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.limited = 0
+        self.lock = threading.Lock()
+
+    def allow(self, client, cost=1):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= min(cost, self.burst)
+            if allowed:
+                tokens -= cost
+            else:
+                self.limited += 1
+            self.buckets[client] = (tokens, now)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        if not allowed:
+            SHED_REQUESTS.labels("rate_limited").inc()
+        return allowed
+
+    def retry_after(self, client, cost=1):
+        # Seconds until `client` could afford `cost`, including any debt from an earlier batch
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            tokens, last = self.buckets.get(client, (self.burst, time.monotonic()))
+        tokens = min(self.burst, tokens + (time.monotonic() - last) * self.rate)
+        return max(1, math.ceil((min(cost, self.burst) - tokens) / self.rate))
+
+    def stats(self):
+        with self.lock:
+            return {"clients": len(self.buckets), "limited": self.limited, "rate_per_s": self.rate, "burst": self.burst}
+
 
 class Mixtral:
     def __init__(self):
@@ -146,36 +1253,923 @@ class Mixtral:
             "Authorization": f"Bearer {self.GROQ_API_KEY}",
             "Content-Type": "application/json"
         }
+        self.system_prompt = "You are ThaparGPT. Answer like a helpful university assistant."
+        # One pooled session per process so connections (and TLS) are reused across calls
+        pool_size = int(os.getenv("GROQ_POOL_SIZE", "16"))
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.timeout = float(os.getenv("GROQ_TIMEOUT", "10"))
+        self.max_retries = int(os.getenv("GROQ_MAX_RETRIES", "2"))
+        self.backoff_base = float(os.getenv("GROQ_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("GROQ_BACKOFF_MAX", "8"))
+        # Hedging is off unless a percentile is configured, e.g. GROQ_HEDGE_PERCENTILE=95
+        self.hedge_percentile = float(os.getenv("GROQ_HEDGE_PERCENTILE", "0"))
+        self.hedge_pool = ThreadPoolExecutor(max_workers=pool_size) if self.hedge_percentile else None
+        self.breaker = CircuitBreaker(
+            threshold=int(os.getenv("GROQ_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("GROQ_BREAKER_RESET", "30"))
+        )
+        self.llm_stats = CallStats("llm")
+
+    def _send(self, payload, stream=False, timeout=None):
+        start = time.monotonic()
+        response = self.session.post(self.api_url, json=payload, timeout=timeout or self.timeout, stream=stream)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableHTTPError(f"{response.status_code} from Groq API", response=response)
+        self.llm_stats.record_latency(time.monotonic() - start)
+        return response
+
+    def _hedged_send(self, payload, timeout=None):
+        # Fire a second identical request if the first is slower than the configured percentile
+        delay = self.llm_stats.percentile(self.hedge_percentile)
+        first = self.hedge_pool.submit(self._send, payload, False, timeout)
+        if delay is None or (timeout and delay >= timeout):
+            return first.result()
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        self.llm_stats.incr("hedged")
+        second = self.hedge_pool.submit(self._send, payload, False, timeout and timeout - delay)
+        done, pending = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            winner = pending.pop()
+        if winner is second and winner.exception() is None:
+            self.llm_stats.incr("hedge_wins")
+        return winner.result()
+
+    def _retry_delay(self, error, attempt):
+        retry_after = None
+        if isinstance(error, RetryableHTTPError) and error.response is not None:
+            header = error.response.headers.get("Retry-After")
+            if header:
+                try:
+                    retry_after = float(header)
+                except ValueError:
+                    try:
+                        retry_after = parsedate_to_datetime(header).timestamp() - time.time()
+                    except (TypeError, ValueError):
+                        retry_after = None
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.backoff_max)
+        # Exponential backoff with jitter
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
 
-    def generate(self, prompt, max_new_token=500, temperature=0.1, top_p=0.9):
+    def _post(self, payload, stream=False, deadline=None):
+        # With a deadline every attempt's timeout is cut to the time left and no retry starts
+        # that could not finish before it
+        if deadline is not None and deadline <= time.monotonic():
+            self.llm_stats.incr("deadline_exceeded")
+            raise DeadlineExceeded("No time left for the Groq API call")
+        if not self.breaker.allow():
+            self.llm_stats.incr("circuit_open")
+            raise RuntimeError("Groq API circuit breaker is open")
+        self.llm_stats.incr("calls")
         try:
-            payload = {
-                "model": "llama3-70b-8192",
-                "messages": [
-                    {"role": "system", "content": "You are ThaparGPT. Answer like a helpful university assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": temperature,
-                "top_p": top_p,
-                "max_tokens": max_new_token
-            }
+            return self._attempts(payload, stream, deadline)
+        finally:
+            self.breaker.release()
 
-            response = requests.post(
-                self.api_url, headers=self.headers, json=payload, timeout=10
-            )
-            response.raise_for_status()
+    def _attempts(self, payload, stream, deadline):
+        attempt = 0
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = min(self.timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    self.llm_stats.incr("deadline_exceeded")
+                    raise DeadlineExceeded("No time left for the Groq API call")
+            try:
+                if self.hedge_pool is not None and not stream:
+                    response = self._hedged_send(payload, timeout)
+                else:
+                    response = self._send(payload, stream=stream, timeout=timeout)
+                response.raise_for_status()
+                self.breaker.record_success()
+                return response
+            except (requests.ConnectionError, requests.Timeout, RetryableHTTPError) as e:
+                if isinstance(e, requests.Timeout):
+                    self.llm_stats.incr("timeouts")
+                elif isinstance(e, RetryableHTTPError):
+                    self.llm_stats.incr(f"http_{e.response.status_code}")
+                else:
+                    self.llm_stats.incr("connection_errors")
+                if attempt >= self.max_retries:
+                    self.llm_stats.incr("errors")
+                    UPSTREAM_ERRORS.labels("groq", type(e).__name__).inc()
+                    self.breaker.record_failure()
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    self.llm_stats.incr("deadline_exceeded")
+                    self.breaker.record_failure()
+                    raise DeadlineExceeded("Groq API did not answer within the deadline") from e
+                time.sleep(delay)
+                attempt += 1
+                self.llm_stats.incr("retries")
+            except requests.HTTPError as e:
+                # Other 4xx responses are our fault, retrying won't help and the upstream is healthy
+                self.breaker.record_success()
+                self.llm_stats.incr(f"http_{e.response.status_code}")
+                self.llm_stats.incr("errors")
+                UPSTREAM_ERRORS.labels("groq", f"http_{e.response.status_code}").inc()
+                raise
+
+    def llm_status(self):
+        snapshot = self.llm_stats.snapshot()
+        snapshot["circuit"] = self.breaker.state()
+        return snapshot
+
+    def _payload(self, prompt, max_new_token, temperature, top_p, stream=False):
+        return {
+            "model": "llama3-70b-8192",
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_new_token,
+            "stream": stream
+        }
+
+    def generate(self, prompt, max_new_token=500, temperature=0.1, top_p=0.9, deadline=None):
+        try:
+            payload = self._payload(prompt, max_new_token, temperature, top_p)
+            response = self._post(payload, deadline=deadline)
             return response.json()["choices"][0]["message"]["content"].strip()
 
         except Exception as e:
-            print(f"[Groq API ERROR]: {str(e)}")
-            raise RuntimeError("Groq API call failed. Check your API key or prompt formatting.")
+            logger.error("Groq API call failed", extra={"error": str(e)})
+            raise RuntimeError("Groq API call failed. Check your API key or prompt formatting.") from e
+
+    def generate_stream(self, prompt, max_new_token=500, temperature=0.1, top_p=0.9, deadline=None):
+        # Yields completion text pieces as the chat-completions stream delivers them; the
+        # deadline bounds the wait for the response to start, not the stream itself
+        try:
+            payload = self._payload(prompt, max_new_token, temperature, top_p, stream=True)
+            with self._post(payload, stream=True, deadline=deadline) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+        except Exception as e:
+            logger.error("Groq API call failed", extra={"error": str(e)})
+            raise RuntimeError("Groq API call failed. Check your API key or prompt formatting.") from e
+
+def parse_records(txt):
+    # "### Title" followed by "- key: value" lines; an empty value opens a nested, indented block
+    records = []
+    stack = []
+    for raw in txt.splitlines():
+        stripped = raw.strip()
+        if not stripped or stripped == "---":
+            continue
+        if stripped.startswith("###"):
+            record = {"title": stripped.lstrip("#").strip(), "fields": {}}
+            records.append(record)
+            stack = [(-1, record["fields"])]
+            continue
+        if not stack:
+            continue
+        indent = len(raw) - len(raw.lstrip())
+        item = stripped[1:].strip() if stripped.startswith("-") else stripped
+        key, sep, value = item.partition(":")
+        if not sep:
+            key, sep, value = item.partition(" - ")
+        if not sep or not key.strip():
+            continue
+        while stack[-1][0] >= indent:
+            stack.pop()
+        if value.strip():
+            stack[-1][1][key.strip()] = value.strip()
+        else:
+            child = {}
+            stack[-1][1][key.strip()] = child
+            stack.append((indent, child))
+    return records
+
+
+def record_key(line):
+    # "- Warden: Dr. X" -> "Warden"; keyless lines such as "Month it took place - March" split on " - "
+    item = line.strip()
+    item = item[1:].strip() if item.startswith("-") else item
+    key, sep, _ = item.partition(":")
+    if not sep:
+        key, sep, _ = item.partition(" - ")
+    return key.strip()
+
+
+def record_tree(lines):
+    # Nest every line under the closest less indented line above it: [(line, children), ...]
+    roots = []
+    stack = [(-1, roots)]
+    for line in lines:
+        indent = len(line) - len(line.lstrip())
+        while stack[-1][0] >= indent:
+            stack.pop()
+        node = (line, [])
+        stack[-1][1].append(node)
+        stack.append((indent, node[1]))
+    return roots
+
+
+def node_lines(node):
+    line, children = node
+    return ([line] if line is not None else []) + [l for child in children for l in node_lines(child)]
+
+
+def pack_nodes(nodes, prefix, max_tokens):
+    # Greedily fill chunks of `prefix` + whole nodes; a node that can't fit even alone is split
+    # into its children with its own line added to the prefix
+    chunks, current = [], []
+    budget = max_tokens - count_tokens("\n".join(prefix))
+    for node in nodes:
+        lines = node_lines(node)
+        if count_tokens("\n".join(current + lines)) <= budget:
+            current += lines
+            continue
+        if current:
+            chunks.append(prefix + current)
+            current = []
+        if count_tokens("\n".join(lines)) <= budget or not node[1]:
+            # A single over-long line stays whole rather than being cut mid-sentence
+            current = lines
+        else:
+            chunks += pack_nodes(node[1], prefix + ([node[0]] if node[0] is not None else []), max_tokens)
+    if current:
+        chunks.append(prefix + current)
+    return chunks
+
+
+def chunk_records(txt, max_tokens=128):
+    # One chunk per "###" record while it fits in max_tokens, with its text unchanged so its
+    # content-addressed id stays put. Longer records are split at blank-line sections, then
+    # top-level bullets, then nested bullets; every piece starts with the record title and
+    # the parent bullets of what it holds. Returns {"text", "title", "fields", "part", "parts"}.
+    chunks = []
+    for record in txt.split("###"):
+        record = record.strip()
+        if not record:
+            continue
+        title, _, body = record.partition("\n")
+        title = title.strip()
+        lines = [line.rstrip() for line in body.splitlines() if line.strip() != "---"]
+        if count_tokens(record) <= max_tokens:
+            pieces = [[title] + [line for line in lines if line]]
+            texts = [record]
+        else:
+            sections, current = [], []
+            for line in lines + [""]:
+                if line.strip():
+                    current.append(line)
+                elif current:
+                    sections.append((None, record_tree(current)))
+                    current = []
+            pieces = pack_nodes(sections, [title], max_tokens)
+            # Lowest limit that still needs no more pieces, so they come out even rather than
+            # one full chunk followed by a near-empty one
+            low, high = count_tokens(title) + 1, max_tokens
+            while low < high:
+                limit = (low + high) // 2
+                if len(pack_nodes(sections, [title], limit)) <= len(pieces):
+                    high = limit
+                else:
+                    low = limit + 1
+            pieces = pack_nodes(sections, [title], high)
+            texts = ["\n".join(piece) for piece in pieces]
+        # Fields are the record's top-level keys each piece covers, repeated parents included
+        indents = [len(line) - len(line.lstrip()) for line in lines if line.strip()]
+        top = min(indents) if indents else 0
+        for part,(piece,text) in enumerate(zip(pieces, texts)):
+            fields = []
+            for line in piece[1:]:
+                key = record_key(line)
+                if line.strip() and len(line) - len(line.lstrip()) == top and key and key not in fields:
+                    fields.append(key)
+            chunks.append({"text": text, "title": title, "fields": fields, "part": part, "parts": len(pieces)})
+    return chunks
+
+
+def metadata_matches(metadata, where):
+    # The subset of chromadb's `where` filters NumpyCollection understands:
+    # {"key": value}, {"key": {"$eq"|"$ne"|"$in"|"$nin": ...}}, {"$and"|"$or": [filters]}
+    for key,condition in where.items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(metadata_matches(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op,operand in condition.items():
+                if op == "$eq" and value != operand or op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand or op == "$nin" and value in operand:
+                    return False
+                if op not in ("$eq", "$ne", "$in", "$nin"):
+                    raise ValueError(f"Unsupported where operator {op!r}")
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def record_leaves(fields, path=()):
+    # (path of keys, value) for every leaf of a parse_records field tree
+    for key,value in fields.items():
+        if isinstance(value, dict):
+            yield from record_leaves(value, path + (key,))
+        else:
+            yield path + (key,), value
+
+
+# Timeouts say so; anything else (open breaker, 4xx, refused connection) is worded neutrally
+EXTRACTIVE_PREFIXES = {
+    "timeout": "The assistant could not write a full answer in time. The most relevant lines from the records:",
+    "unavailable": "The assistant could not generate a full answer right now. The most relevant lines from the records:"
+}
+
+
+def extractive_answer(query, context, weight, max_lines=6, reason="unavailable"):
+    # Best matching record lines from ranked contexts by weighted term overlap with the query.
+    # Words matched by a line's own key or value count fully, words matched only by its title or
+    # parent keys count half, so "Agira Hall 2 sharing AC" picks the 2 Sharing > AC line.
+    def words(txt):
+        return {tok for tok in fact_tokens(txt) if tok not in STOPWORDS}
+
+    terms = words(query)
+    candidates = []
+    for rank,text in enumerate(context):
+        # Stored chunks have their "###" marker split off; the first line is still the title
+        text = text.strip()
+        records = parse_records(text if text.startswith("#") else f"### {text}")
+        if not records:
+            records = [{"title": "", "fields": {line.strip(): "" for line in text.splitlines() if line.strip()}}]
+        for record in records:
+            title_terms = words(record["title"]) & terms
+            for pos,(path,value) in enumerate(record_leaves(record["fields"])):
+                if value.strip().lower() in ("nan", "-", "none"):
+                    continue
+                own = words(f"{path[-1]} {value}") & terms
+                inherited = (words(" ".join(path[:-1])) & terms | title_terms) - own
+                score = sum(weight(t) for t in own) + 0.5 * sum(weight(t) for t in inherited)
+                if score > 0:
+                    candidates.append((score, rank, pos, record["title"], path, value))
+    if not candidates:
+        return "❌Information not found in records"
+    best = sorted(candidates, key=lambda c: (-c[0], c[1], c[2]))[:max_lines]
+    lines = [EXTRACTIVE_PREFIXES[reason]]
+    title = None
+    for _,rank,_,record_title,path,value in sorted(best, key=lambda c: (c[1], c[2])):
+        if (rank, record_title) != title:
+            title = (rank, record_title)
+            if record_title:
+                lines.append(f"\n{record_title}")
+        lines.append(f"- {' > '.join(path)}: {value}" if value else f"- {' > '.join(path)}")
+    return "\n".join(lines)
+
+
+def parse_amount(value):
+    if not isinstance(value, str) or value.strip().lower() in ("", "nan", "-", "none"):
+        return None
+    match = re.search(r"\d[\d,]*(?:\.\d+)?", value.replace("Rs.", ""))
+    return float(match.group().replace(",", "")) if match else None
+
+
+def format_amount(amount):
+    return f"₹{amount:.0f}" if amount == int(amount) else f"₹{amount:.2f}"
+
+
+def fact_tokens(txt):
+    # Lowercase words with "m.tech"-style dots removed and simple plurals folded ("fees" -> "fee")
+    txt = re.sub(r"(?<=\b[a-z])\.(?=[a-z])", "", txt.lower())
+    tokens = []
+    for tok in re.findall(r"[a-z0-9%]+", txt):
+        if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+@lru_cache(maxsize=1024)
+def fact_phrase(phrase):
+    return f" {' '.join(fact_tokens(phrase))} "
+
+
+class FactQuery:
+    def __init__(self, query):
+        self.raw = query.lower()
+        self.tokens = fact_tokens(query)
+        # Unfolded words too, so names like "Tejas" still match
+        self.token_set = set(self.tokens) | set(re.findall(r"[a-z0-9]+", self.raw))
+        self.text = f" {' '.join(self.tokens)} "
+
+    def has(self, *phrases):
+        return any(fact_phrase(p) in self.text for p in phrases)
+
+    def sharing(self):
+        if self.has("single", "single room", "1 seater"):
+            return 1
+        words = {"double": 2, "triple": 3}
+        for word,n in words.items():
+            if self.has(word):
+                return n
+        match = re.search(r"\b([1-4])\s*-?\s*(?:sharing|seater|share|bed)", self.raw)
+        return int(match.group(1)) if match else None
+
+    def ac(self):
+        if self.has("non ac", "nonac", "without ac", "no ac"):
+            return False
+        if "ac" in self.token_set or self.has("air conditioned"):
+            return True
+        return None
+
+
+class FactEngine:
+    # Typed tables parsed from the generated Structured_Data records, for answering
+    # direct fee/hostel/placement lookups without retrieval or an LLM call
+    MIN_WORDS = ("cheapest", "lowest", "minimum", "least", "smallest", "min")
+    MAX_WORDS = ("most expensive", "costliest", "highest", "maximum", "largest", "biggest", "max")
+    FEE_WORDS = ("fee", "cost", "charge", "price", "rent", "how much")
+    # Procedural, policy or opinion questions mention a fee or hostel but aren't table lookups
+    NON_LOOKUP_WORDS = (
+        "how do", "how to", "how can", "pay", "paying", "paid", "payment", "refund", "include",
+        "included", "including", "last date", "due date", "deadline", "policy", "policies", "rule",
+        "compulsory", "mandatory", "worth", "best", "timing", "procedure", "process", "why"
+    )
+
+    def __init__(self):
+        self.programmes = []
+        self.hostels = {}
+        self.placements = []
+        self.programme_index = {}
+        self.placement_index = {}
+
+    def load(self, files_data):
+        programmes, hostels, placements = [], {}, []
+        for filename,content in sorted(files_data.items()):
+            name = filename.lower()
+            if name.startswith("hostel_fee"):
+                self._load_hostel_grid(parse_records(content), hostels)
+            elif name.startswith("hostel_info"):
+                self._load_hostel_info(parse_records(content), hostels)
+            elif "placement" in name:
+                placements += self._load_placements(parse_records(content))
+            elif "fee" in name:
+                programmes += self._load_programmes(parse_records(content))
+        self.programmes = programmes
+        self.hostels = hostels
+        self.placements = placements
+        self.programme_index = self._alias_index(programmes)
+        self.placement_index = self._alias_index(placements)
+
+    def _load_programmes(self, records):
+        columns = {
+            "number of semester": "semesters",
+            "total": "total",
+            "equal installment": "per_semester",
+            "tuition": "tuition",
+            "development": "development",
+            "other charges": "other"
+        }
+        rows = []
+        for record in records:
+            row = {"name": record["title"]}
+            for key,value in record["fields"].items():
+                for marker,column in columns.items():
+                    if marker in key.lower():
+                        row[column] = parse_amount(value)
+                        break
+            if "total" in row:
+                rows.append(row)
+        return rows
+
+    def _load_placements(self, records):
+        columns = {
+            "year": "year",
+            "highest package": "highest",
+            "average package": "average",
+            "median package": "median",
+            "placement percentage": "percentage",
+            "recruiters": "recruiters"
+        }
+        rows = []
+        for record in records:
+            if not record["title"].lower().startswith("program"):
+                continue
+            row = {"name": record["title"].split(":", 1)[-1].strip()}
+            for key,value in record["fields"].items():
+                for marker,column in columns.items():
+                    if marker in key.lower() and column not in row:
+                        row[column] = value
+            rows.append(row)
+        return rows
+
+    def _alias_index(self, rows):
+        # First word of the programme name ("MCA", "M.Tech", "ME/MTech") is the lookup alias
+        index = {}
+        for row in rows:
+            row["tokens"] = set(fact_tokens(row["name"]))
+            head = re.split(r"[\s(-]", row["name"].strip(), maxsplit=1)[0]
+            for alias in head.split("/"):
+                alias = "".join(fact_tokens(alias))
+                if alias and alias != "me":
+                    index.setdefault(alias, []).append(row)
+        return index
+
+    def _hostel(self, hostels, title):
+        previous = re.search(r"\(Previously:\s*([^)]+)\)", title)
+        name = re.sub(r"\(.*?\)", "", title).strip()
+        words = [tok for tok in re.findall(r"[a-z0-9]+", name.lower()) if tok not in ("hall", "hostel")]
+        if not words or words[0] == "nan":
+            return None
+        hostel = hostels.setdefault(words[0], {"key": words[0], "name": name, "room_fees": {}})
+        if previous:
+            hostel["previous"] = previous.group(1).strip()
+        if "hall" in name.lower():
+            hostel["name"] = name
+        return hostel
+
+    def _load_hostel_grid(self, records, hostels):
+        for record in records:
+            hostel = self._hostel(hostels, record["title"])
+            if hostel is None:
+                continue
+            for sharing,prices in record["fields"].get("Room Types and Washroom Details", {}).items():
+                n = parse_amount(sharing)
+                if n is None or not isinstance(prices, dict):
+                    continue
+                for label,value in prices.items():
+                    amount = parse_amount(value)
+                    if amount is not None:
+                        hostel["room_fees"].setdefault((int(n), label.lower() == "ac"), amount)
+
+    def _load_hostel_info(self, records, hostels):
+        columns = {
+            "residence type": "type",
+            "capacity": "capacity",
+            "ac room availability": "ac_availability",
+            "mess fees": "mess_fee",
+            "assistant warden": "assistant_warden",
+            "warden": "warden",
+            "email": "email",
+            "reception": "reception",
+            "amenities": "amenities",
+            "floors": "floors",
+            "late entry": "late_entry"
+        }
+        for record in records:
+            hostel = self._hostel(hostels, record["title"])
+            if hostel is None:
+                continue
+            for key,value in record["fields"].items():
+                if key == "Caretakers" and isinstance(value, dict):
+                    hostel["caretakers"] = "; ".join(f"{shift}: {who}" for shift,who in value.items())
+                elif key == "Room Fees" and isinstance(value, dict):
+                    grid = dict(hostel["room_fees"])
+                    for sharing,price in value.items():
+                        n = 1 if sharing.lower() == "single" else parse_amount(sharing)
+                        if n is None:
+                            continue
+                        labelled = re.findall(r"₹\s*([\d,]+)\s*\((non-AC|AC)\)", price, flags=re.I)
+                        if labelled:
+                            for amount,label in labelled:
+                                grid.setdefault((int(n), label.lower() == "ac"), parse_amount(amount))
+                        elif not any(k[0] == int(n) for k in grid):
+                            # AC/non-AC not stated; only used when the grid has nothing for this sharing
+                            grid[(int(n), None)] = parse_amount(price)
+                    hostel["room_fees"] = grid
+                elif not isinstance(value, dict):
+                    for marker,column in columns.items():
+                        if key.lower().startswith(marker):
+                            hostel.setdefault(column, value)
+                            break
+            if "capacity" in hostel:
+                hostel["capacity_n"] = parse_amount(hostel["capacity"])
+            if "mess_fee" in hostel:
+                hostel["mess_fee_n"] = parse_amount(hostel["mess_fee"])
+
+    def answer(self, query):
+        q = FactQuery(query)
+        if q.has(*self.NON_LOOKUP_WORDS):
+            return None
+        for handler in (self._hostel_answer, self._placement_answer, self._programme_answer):
+            answer = handler(q)
+            if answer:
+                return answer
+        return None
+
+    def _match_rows(self, q, index):
+        rows = []
+        for alias,candidates in index.items():
+            if alias in q.token_set:
+                rows += candidates
+        if len(rows) > 1:
+            # Narrow "M.Tech" style matches by the other words of the programme name
+            overlap = [len((row["tokens"] & q.token_set) - set(index)) for row in rows]
+            if max(overlap) > 0:
+                rows = [row for row,n in zip(rows, overlap) if n == max(overlap)]
+        return rows
+
+    def _room_options(self, hostel, sharing, ac):
+        options = []
+        for (n, is_ac),amount in sorted(hostel["room_fees"].items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            if sharing is not None and n != sharing:
+                continue
+            if ac is not None and is_ac != ac:
+                continue
+            options.append((n, is_ac, amount))
+        return options
+
+    def _room_label(self, n, is_ac):
+        label = "Single" if n == 1 else f"{n} Sharing"
+        if is_ac is None:
+            return label
+        return f"{label} {'AC' if is_ac else 'Non-AC'}"
+
+    def _hostel_answer(self, q):
+        named = [h for key,h in self.hostels.items() if key in q.token_set]
+        for hostel in self.hostels.values():
+            previous = hostel.get("previous", "")
+            letter = previous.split("-")[-1].lower() if previous else None
+            if letter and re.search(rf"\bhostel[\s-]*{re.escape(letter)}\b", q.raw) and hostel not in named:
+                named.append(hostel)
+        if not named and not q.has("hostel", "hall", "room", "sharing", "mess", "warden", "accommodation", "accomodation"):
+            return None
+        if q.has("scholarship", "placement", "syllabus"):
+            return None
+
+        attributes = [
+            ("assistant_warden", ("assistant warden",)),
+            ("warden", ("warden",)),
+            ("caretakers", ("caretaker",)),
+            ("reception", ("reception",)),
+            ("email", ("email", "mail id")),
+            ("mess_fee", ("mess fee", "mess charge", "mess cost")),
+            ("capacity", ("capacity", "how many student", "seat")),
+            ("late_entry", ("late entry", "entry time", "curfew", "in time")),
+            ("floors", ("floor",)),
+            ("amenities", ("amenity", "amenities", "facility", "facilities", "wifi", "laundry")),
+            ("type", ("boy or girl", "girl or boy", "for boy", "for girl", "residence type")),
+            ("room_fees", self.FEE_WORDS + ("sharing", "single", "seater"))
+        ]
+        matched = [name for name,phrases in attributes if q.has(*phrases)]
+        # "assistant warden" also says "warden", and "mess fee" also says "fee"
+        if "assistant_warden" in matched:
+            matched.remove("warden")
+        if "mess_fee" in matched and "room_fees" in matched and not q.has("room", "sharing", "single", "seater"):
+            matched.remove("room_fees")
+        if len(matched) > 1:
+            # One table cell per answer; several attributes at once are left to retrieval
+            return None
+        attribute = matched[0] if matched else None
+        sharing, ac = q.sharing(), q.ac()
+
+        if named:
+            if attribute is None:
+                return None
+            lines = []
+            for hostel in named:
+                if attribute == "room_fees":
+                    options = self._room_options(hostel, sharing, ac)
+                    if not options:
+                        lines.append(f"{hostel['name']}: no matching room option listed")
+                        continue
+                    fees = ", ".join(f"{self._room_label(n, is_ac)} {format_amount(a)}" for n,is_ac,a in options)
+                    lines.append(f"{hostel['name']} room fees (per semester): {fees}")
+                elif attribute in hostel:
+                    label = attribute.replace("_", " ").capitalize()
+                    lines.append(f"{hostel['name']} - {label}: {hostel[attribute]}")
+                else:
+                    lines.append(f"{hostel['name']} - {attribute.replace('_', ' ')}: Not specified in official records")
+            return "\n".join(lines)
+
+        hostels = list(self.hostels.values())
+        for gender in ("girl", "boy"):
+            if gender in q.token_set:
+                hostels = [h for h in hostels if h.get("type", "").lower().startswith(gender)]
+        if q.has("how many hostel", "number of hostel"):
+            return f"There are {len(hostels)} hostels listed: {', '.join(h['name'] for h in hostels)}."
+        want_min, want_max = q.has(*self.MIN_WORDS), q.has(*self.MAX_WORDS)
+
+        if attribute == "capacity":
+            rows = [h for h in hostels if h.get("capacity_n")]
+            if not rows:
+                return None
+            if q.has("total"):
+                return f"Total hostel capacity: {sum(h['capacity_n'] for h in rows):.0f} students across {len(rows)} hostels."
+            if want_min or want_max:
+                pick = (min if want_min else max)(rows, key=lambda h: h["capacity_n"])
+                return f"{pick['name']} has the {'smallest' if want_min else 'largest'} capacity: {pick['capacity']} students."
+            return None
+        if attribute == "mess_fee":
+            fees = {h["mess_fee"] for h in hostels if h.get("mess_fee")}
+            if len(fees) == 1:
+                return f"Mess fee is {fees.pop()} in all hostels."
+            return "\n".join(f"{h['name']}: {h['mess_fee']}" for h in hostels if h.get("mess_fee")) or None
+        if attribute != "room_fees":
+            return None
+
+        options = [(h, n, is_ac, a) for h in hostels for n,is_ac,a in self._room_options(h, sharing, ac)]
+        if not options:
+            return None
+        if want_min or want_max:
+            best = (min if want_min else max)(a for _,_,_,a in options)
+            picks = [(h, n, is_ac) for h,n,is_ac,a in options if a == best]
+            where = ", ".join(f"{h['name']} ({self._room_label(n, is_ac)})" for h,n,is_ac in picks)
+            return f"{'Cheapest' if want_min else 'Most expensive'} room: {format_amount(best)} per semester at {where}."
+        if sharing is None and ac is None:
+            # No room type given: summarise the range for each room type
+            ranges = {}
+            for _,n,is_ac,a in options:
+                ranges.setdefault((n, is_ac), []).append(a)
+            lines = [
+                f"{self._room_label(n, is_ac)}: {format_amount(min(v))}" + (f" - {format_amount(max(v))}" if max(v) != min(v) else "")
+                for (n, is_ac),v in sorted(ranges.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            ]
+            return "Hostel room fees per semester:\n" + "\n".join(f"- {line}" for line in lines)
+        lines = [f"- {h['name']} ({self._room_label(n, is_ac)}): {format_amount(a)}" for h,n,is_ac,a in options]
+        return "Hostel room fees per semester:\n" + "\n".join(lines)
+
+    def _programme_answer(self, q):
+        if q.has("scholarship", "waiver", "hostel", "mess", "syllabus", "subject", "placement", "package"):
+            return None
+        columns = [
+            ("tuition", "Tuition fee per semester", ("tuition",)),
+            ("development", "Development fee per semester", ("development",)),
+            ("other", "Other charges per semester", ("other charge",)),
+            ("semesters", "Number of semesters", ("how many semester", "number of semester", "duration", "how long")),
+            ("per_semester", "Fee per semester", ("per semester", "each semester", "semester fee", "per sem", "installment")),
+            ("total", "Total programme fee", ("total",))
+        ]
+        selected = [(column, label) for column,label,phrases in columns if q.has(*phrases)]
+        want_min, want_max = q.has(*self.MIN_WORDS), q.has(*self.MAX_WORDS)
+        if not selected:
+            if not (q.has(*self.FEE_WORDS) or want_min or want_max):
+                return None
+            selected = [("total", "Total programme fee"), ("per_semester", "Fee per semester")]
+
+        rows = self._match_rows(q, self.programme_index)
+        if not rows:
+            if not (want_min or want_max) or not q.has("programme", "program", "course", "pg"):
+                return None
+            column, label = selected[0] if selected[0][0] != "semesters" else ("total", "Total programme fee")
+            rows = [row for row in self.programmes if row.get(column) is not None]
+            if not rows:
+                return None
+            pick = (min if want_min else max)(rows, key=lambda row: row[column])
+            return f"{pick['name']} has the {'lowest' if want_min else 'highest'} {label.lower()}: {format_amount(pick[column])}."
+
+        lines = []
+        for row in rows:
+            parts = []
+            for column,label in selected:
+                value = row.get(column)
+                if value is None:
+                    parts.append(f"{label}: Not specified in official records")
+                elif column == "semesters":
+                    parts.append(f"{label}: {value:.0f}")
+                else:
+                    parts.append(f"{label}: {format_amount(value)}")
+            lines.append(f"{row['name']} - " + ", ".join(parts))
+        return "\n".join(lines)
+
+    def _placement_answer(self, q):
+        if not q.has("placement", "placed", "package", "lpa", "recruiter", "salary", "ctc", "company", "companies"):
+            return None
+        columns = [
+            ("highest", "Highest package", ("highest", "maximum package", "max package")),
+            ("average", "Average package", ("average", "avg", "mean")),
+            ("median", "Median package", ("median",)),
+            ("percentage", "Placement percentage", ("percentage", "%", "placement rate", "how many placed", "how many student")),
+            ("recruiters", "Top recruiters", ("recruiter", "company", "companies"))
+        ]
+        selected = [(column, label) for column,label,phrases in columns if q.has(*phrases)]
+        rows = self._match_rows(q, self.placement_index)
+        if not rows:
+            if selected and selected[0][0] == "highest":
+                rows = [row for row in self.placements if parse_amount(row.get("highest")) is not None]
+                if not rows:
+                    return None
+                pick = max(rows, key=lambda row: parse_amount(row["highest"]))
+                return f"Highest PG package: {pick['highest']} ({pick['name']}, {pick.get('year', 'year not specified')})."
+            return None
+        if not selected:
+            selected = [(column, label) for column,label,_ in columns]
+        lines = []
+        for row in rows:
+            parts = [f"{label}: {row.get(column, 'Not specified in official records')}" for column,label in selected]
+            lines.append(f"{row['name']} ({row.get('year', 'year not specified')}) - " + ", ".join(parts))
+        return "\n".join(lines)
+
+
+# Static instructions go in the system message, built once, so every request shares the same
+# prefix; only the retrieved context and the question change per call
+PROMPT_PREFIX = """You are ThaparGPT, a helpful assistant for Thapar University with two response modes:
+
+# When context exists:
+1. STRICTLY prioritize the provided official context
+2. Use exact figures/terms (₹ instead of Rs/INR)
+3. Format lists with bullet points
+4. For numerical queries, provide exact values only
+5. Never hallucinate details - say "Not specified in official records" if unsure
+
+# For general queries:
+1. Use your knowledge about Indian universities
+2. Clearly mark non-context answers with [General Knowledge]
+3. For comparisons, maintain neutrality
+4. When estimating, disclose it's an approximation
+
+# For greetings like hello , hi , bye , thanks and thank you:
+Greet the user.
+
+For each user question, first determine if this is:
+A) A specific factual query about Thapar (use context)
+B) A general higher-education question (wider knowledge)
+C) Administrative (dates/processes - be precise)
+
+Then provide a 1-2 sentence response accordingly, using the format:
+[Your answer]"""
+
+
+def count_tokens(txt):
+    # Tokenizer-free estimate (~4 characters per sub-word piece), close enough for budgeting
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in re.findall(r"\w+|[^\w\s]", txt))
+
+
+def trim_to_tokens(txt, budget):
+    # Keep whole lines (the ### title first) until the budget runs out
+    lines = []
+    used = 0
+    for line in txt.splitlines():
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+
+PROMPT_PREFIX_TOKENS = count_tokens(PROMPT_PREFIX)
+
 
 class ThaparAssistant(VectorDB, Mixtral):
     
-    def __init__(self):
-        VectorDB.__init__(self)
+    def __init__(self, progress=None):
+        VectorDB.__init__(self, progress)
         Mixtral.__init__(self)
+        self.answer_cache = AnswerCache(
+            max_size=int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+        )
+        self.single_flight = SingleFlight()
+        # Collections within ROUTER_MARGIN of the best centroid score are searched together
+        self.router_fanout = int(os.getenv("ROUTER_FANOUT", "2"))
+        self.router_margin = float(os.getenv("ROUTER_MARGIN", "0.05"))
+        # Lexical candidates fused with vector hits; a clear BM25 winner skips embedding altogether
+        self.top_k = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+        self.candidate_k = int(os.getenv("RETRIEVAL_CANDIDATES", "8"))
+        self.bm25_fastpath_ratio = float(os.getenv("BM25_FASTPATH_RATIO", "2.0"))
+        self.bm25_fastpath_min_score = float(os.getenv("BM25_FASTPATH_MIN_SCORE", "6.0"))
+        self.stage_stats = {
+            name: CallStats(name) for name in ("ask", "ask_many", "facts", "lexical", "embed", "route", "search", "prompt", "generate", "fallback")
+        }
+        # Concurrent LLM calls per ask_many batch
+        self.batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "4"))
+        self.batch_max_queries = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+        # Global cap on concurrent LLM generations with a bounded, deadline-limited wait queue
+        self.admission = AdmissionController(
+            max_active=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+            timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "5"))
+        )
+        # End-to-end budget for one question (ASK_DEADLINE=0 means none). Query embedding gets at
+        # most ASK_EMBED_BUDGET of it, queueing and generation get the rest minus a small reserve
+        # for the extractive answer, which replaces the LLM answer when generation can't finish.
+        self.ask_deadline = float(os.getenv("ASK_DEADLINE", "12"))
+        self.embed_budget = float(os.getenv("ASK_EMBED_BUDGET", "2"))
+        self.fallback_reserve = float(os.getenv("ASK_FALLBACK_RESERVE", "0.2"))
+        self.extractive_fallback = os.getenv("EXTRACTIVE_FALLBACK", "1") == "1"
+        self.extractive_max_lines = int(os.getenv("EXTRACTIVE_MAX_LINES", "6"))
+        self.embed_pool = ThreadPoolExecutor(max_workers=int(os.getenv("EMBED_CONCURRENCY", "4")))
+        self.system_prompt = PROMPT_PREFIX
+        self.prompt_token_budget = int(os.getenv("PROMPT_CONTEXT_TOKENS", "900"))
+        self.facts = FactEngine()
         self.populate_db()
+
+    def populate_db(self):
+        VectorDB.populate_db(self)
+        self.progress("facts")
+        self.facts.load(self.load_files())
         
     def _determineCollectionType(self,query):
         query_lower =query.lower()
@@ -192,92 +2186,616 @@ class ThaparAssistant(VectorDB, Mixtral):
         else:
             return "activities"
             
-    def build_prompt(self, query, context):
+    def route(self, query, query_embedding):
+        start = time.monotonic()
+        scores = self.route_scores(query_embedding)
+        if scores:
+            best = scores[0][1]
+            col_types = [col for col,score in scores[:self.router_fanout] if score >= best - self.router_margin]
+        else:
+            # No vectors to build centroids from yet, fall back to keyword routing
+            col_types = [self._determineCollectionType(query)]
+        self.stage_stats["route"].record_latency(time.monotonic() - start)
+        return col_types
+            
+    def assemble_prompt(self, query, context):
+        # Fit ranked contexts into the token budget: drop duplicates, trim or drop the lowest ranked
+        budget = self.prompt_token_budget
+        kept = []
+        seen = []
+        dropped = trimmed = 0
+        for text in context:
+            words = set(tokenize(text))
+            if any(words and len(words & other) / len(words | other) >= 0.9 for other in seen):
+                dropped += 1
+                continue
+            tokens = count_tokens(text)
+            if tokens > budget:
+                if budget < 32:
+                    dropped += 1
+                    continue
+                text = trim_to_tokens(text, budget)
+                tokens = count_tokens(text)
+                trimmed += 1
+            seen.append(words)
+            kept.append(text)
+            budget -= tokens
         context_str = "\n\n".join([
             f"CONTEXT {i+1}:\n{text}" 
-            for i, text in enumerate(context)
+            for i, text in enumerate(kept)
         ])
-        return f"""You are a helpful assistant for Thapar University with two response modes:
+        prompt = f"""Current Context:
+{context_str if kept else 'No specific context provided'}
 
-# When context exists:
-1. STRICTLY prioritize the provided official context
-2. Use exact figures/terms (₹ instead of Rs/INR)
-3. Format lists with bullet points
-4. For numerical queries, provide exact values only
-5. Never hallucinate details - say "Not specified in official records" if unsure
+User Question: {query}"""
+        prompt_tokens = PROMPT_PREFIX_TOKENS + count_tokens(prompt)
+        self.stage_stats["prompt"].incr("requests")
+        self.stage_stats["prompt"].incr("prompt_tokens", prompt_tokens)
+        self.stage_stats["prompt"].incr("contexts_dropped", dropped)
+        self.stage_stats["prompt"].incr("contexts_trimmed", trimmed)
+        PROMPT_TOKENS.observe(prompt_tokens)
+        return prompt, {"prompt_tokens": prompt_tokens, "contexts": len(kept), "dropped": dropped, "trimmed": trimmed}
 
-# For general queries:
-1. Use your knowledge about Indian universities
-2. Clearly mark non-context answers with [General Knowledge]
-3. For comparisons, maintain neutrality
-4. When estimating, disclose it's an approximation
+    def build_prompt(self, query, context):
+        return self.assemble_prompt(query, context)[0]
+    
+    def _lexical_confident(self, hits):
+        if not hits or hits[0][1] < self.bm25_fastpath_min_score:
+            return False
+        return len(hits) == 1 or hits[0][1] >= self.bm25_fastpath_ratio * hits[1][1]
 
-# For greetings like hello , hi , bye , thanks and thank you:
-Greet the user.
+    def _fuse(self, *rankings, k=60):
+        # Reciprocal rank fusion of several ranked chunk id lists
+        scores = {}
+        for ranking in rankings:
+            for rank,chunk_id in enumerate(ranking):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+        return sorted(scores, key=scores.get, reverse=True)
 
-Current Context:
-{context_str if context else 'No specific context provided'}
+    def _prepare_local(self, query):
+        # Everything that needs no embedding: facts, exact answer cache, BM25 fast path.
+        # Returns a finished plan, or {"lexical_hits": ...} when vector retrieval is needed.
+        start = time.monotonic()
+        fact = self.facts.answer(query)
+        self.stage_stats["facts"].record_latency(time.monotonic() - start)
+        if fact is not None:
+            # Direct lookups and simple aggregates come straight from the parsed tables
+            self.stage_stats["facts"].incr("answered")
+            return {"answer": fact, "facts": True}
+        cached = self.answer_cache.get(query, self.manifest)
+        if cached is not None:
+            return {"answer": cached}
+        start = time.monotonic()
+        lexical_hits = self.lexical.search(query, top_k=self.candidate_k)
+        self.stage_stats["lexical"].record_latency(time.monotonic() - start)
+        if self._lexical_confident(lexical_hits):
+            # Query names a specific record; no embedding round trip needed
+            self.stage_stats["lexical"].incr("fast_path")
+            chunk_ids = [cid for cid,_ in lexical_hits[:self.top_k]]
+            return {
+                "collection": self.lexical.collection(chunk_ids[0]),
+                "collections": sorted({self.lexical.collection(cid) for cid in chunk_ids}),
+                "embedding": None,
+                "context": [self.lexical.text(cid) for cid in chunk_ids],
+                "chunk_ids": chunk_ids
+            }
+        return {"lexical_hits": lexical_hits}
 
-User Question: {query}
+    def _prepare_vector(self, queries, partials, embeddings):
+        # Route every query, check the semantic answer cache, then one search_many for the rest
+        plans = [None] * len(queries)
+        searches = []
+        for i,(query,embedding) in enumerate(zip(queries, embeddings)):
+            col_types = self.route(query, embedding)
+            cached = self.answer_cache.nearest(embedding, col_types[0], self.manifest)
+            if cached is not None:
+                plans[i] = {"answer": cached, "collection": col_types[0]}
+            else:
+                searches.append((i, col_types))
+        if searches:
+            start = time.monotonic()
+            results = self.search_many(
+                [embeddings[i] for i,_ in searches], [col_types for _,col_types in searches], top_k=self.candidate_k
+            )
+            self.stage_stats["search"].record_latency(time.monotonic() - start)
+            for (i,col_types),(vector_docs,vector_ids) in zip(searches, results):
+                docs = dict(zip(vector_ids, vector_docs))
+                chunk_ids = self._fuse(vector_ids, [cid for cid,_ in partials[i]["lexical_hits"]])[:self.top_k]
+                plans[i] = {
+                    "collection": col_types[0],
+                    "collections": col_types,
+                    "embedding": embeddings[i],
+                    "context": [docs[cid] if cid in docs else self.lexical.text(cid) for cid in chunk_ids],
+                    "chunk_ids": chunk_ids
+                }
+        return plans
 
-First determine if this is:
-A) A specific factual query about Thapar (use context)
-B) A general higher-education question (wider knowledge)
-C) Administrative (dates/processes - be precise)
+    def deadline(self, seconds=None):
+        # Absolute monotonic deadline for a request; a per-request budget can only shorten the default
+        budgets = [b for b in (seconds, self.ask_deadline) if b]
+        return time.monotonic() + min(budgets) if budgets else None
 
-Then provide a 1-2 sentence response accordingly, using the format:
-[Your answer]"""
-    
-    def ask(self, query):
+    def _lexical_plan(self, query, lexical_hits):
+        # Retrieval without a query vector, used when embedding misses its budget
+        chunk_ids = [cid for cid,_ in lexical_hits[:self.top_k]]
+        collection = self.lexical.collection(chunk_ids[0]) if chunk_ids else self._determineCollectionType(query)
+        return {
+            "collection": collection,
+            "collections": sorted({self.lexical.collection(cid) for cid in chunk_ids}) or [collection],
+            "embedding": None,
+            "context": [self.lexical.text(cid) for cid in chunk_ids],
+            "chunk_ids": chunk_ids
+        }
+
+    def _embed_query(self, query, deadline):
+        if deadline is None or not self.extractive_fallback:
+            with self.stage_stats["embed"].timer():
+                return self.embedder.embed_query(query)
+        budget = min(self.embed_budget, deadline - time.monotonic())
+        future = self.embed_pool.submit(self.embedder.embed_query, query)
         try:
-            col_type = self._determineCollectionType(query)
-            context = self.query(query, col_type)
-            # print(f"\nRETRIEVED CONTEXT FOR '{query}':")
-            # for i, text in enumerate(context, 1):
-            #     print(f"[Context {i}]: {text[:200]}...")
-            prompt = self.build_prompt(query, context)
-            response = self.generate(prompt)
-            # if "Rs" not in response and any("Rs." in ctx for ctx in context):
-            #     response = "❌Information not found in records"
-            return response
+            with self.stage_stats["embed"].timer():
+                # The call keeps running after a timeout and still fills the query cache
+                return future.result(timeout=max(budget, 0))
         except Exception as e:
+            self.stage_stats["embed"].incr("timeouts" if isinstance(e, FutureTimeout) else "errors")
+            logger.warning("Query embedding unavailable, using lexical retrieval", extra={"error": repr(e)})
+            return None
+
+    def _prepare(self, query, deadline=None):
+        # Routing + retrieval shared by ask and ask_stream; short-circuits on a cached answer
+        plan = self._prepare_local(query)
+        if "lexical_hits" not in plan:
+            return plan
+        query_embedding = self._embed_query(query, deadline)
+        if query_embedding is None:
+            return self._lexical_plan(query, plan["lexical_hits"])
+        return self._prepare_vector([query], [plan], [query_embedding])[0]
+
+    def extractive_answer(self, query, context, reason="unavailable"):
+        with self.stage_stats["fallback"].timer():
+            return extractive_answer(query, context, self.lexical.idf, self.extractive_max_lines, reason)
+
+    def _fallback(self, query, plan, error):
+        # Answer from the retrieved chunks alone; never cached, so the next ask tries the LLM again.
+        # A full queue still sheds with 503: that is the signal for clients to back off.
+        if not self.extractive_fallback or isinstance(error, Overloaded) and error.reason == "queue_full":
+            raise error
+        cause = error.__cause__ or error
+        self.stage_stats["fallback"].incr(type(cause).__name__)
+        logger.warning("Generation unavailable, answering extractively", extra={"query": query, "error": str(cause)})
+        # Overloaded only gets here after waiting out its slot deadline
+        timed_out = isinstance(cause, (DeadlineExceeded, Overloaded, requests.Timeout))
+        return self.extractive_answer(query, plan["context"], "timeout" if timed_out else "unavailable")
+
+    def _generation_deadline(self, deadline):
+        return None if deadline is None else deadline - self.fallback_reserve
+
+    def _generate_answer(self, query, plan, deadline=None):
+        prompt = self.build_prompt(query, plan["context"])
+        generation_deadline = self._generation_deadline(deadline)
+        try:
+            with self.admission.slot(generation_deadline), self.stage_stats["generate"].timer():
+                response = self.generate(prompt, deadline=generation_deadline)
+        except Exception as e:
+            return self._fallback(query, plan, e)
+        # if "Rs" not in response and any("Rs." in ctx for ctx in context):
+        #     response = "❌Information not found in records"
+        self.answer_cache.put(query, plan["collection"], plan["embedding"], response, plan["chunk_ids"])
+        return response
+
+    def _answer(self, query, deadline=None):
+        plan = self._prepare(query, deadline)
+        if "answer" in plan:
+            return plan["answer"]
+        return self._generate_answer(query, plan, deadline)
+
+    def ask(self, query, deadline=None):
+        # `deadline` is a budget in seconds, capped by ASK_DEADLINE
+        try:
+            deadline = self.deadline(deadline)
+            # Identical questions arriving together share one retrieval and one LLM call
+            key = (normalize_query(query), self._determineCollectionType(query))
+            with self.stage_stats["ask"].timer():
+                return self.single_flight.do(key, lambda: self._answer(query, deadline))
+        except Overloaded:
+            # Callers turn this into a 503/429 instead of a slow "System error"
+            raise
+        except Exception as e:
+            logger.exception("ask failed")
+            self.stage_stats["ask"].incr("errors")
             return f"System error: {str(e)}"
 
+    def ask_many_iter(self, queries, concurrency=None, deadline=None):
+        # Yields (index, result) as each answer is ready. Retrieval is batched: one embed call
+        # for every query that needs vectors and one search per collection; only generation
+        # fans out, at most `concurrency` LLM calls at a time. Repeated questions share a result.
+        # A deadline, if given, applies to generation for the whole batch; otherwise each
+        # generation gets ASK_DEADLINE from when it starts.
+        deadline = deadline and time.monotonic() + deadline
+        groups = OrderedDict()
+        for i,query in enumerate(queries):
+            if not isinstance(query, str) or not query.strip():
+                yield i, {"query": query, "error": "query must be a non-empty string"}
+                continue
+            groups.setdefault(normalize_query(query), []).append(i)
+        unique = [queries[indices[0]] for indices in groups.values()]
+        indices = list(groups.values())
+
+        def results(u, result):
+            return [(i, dict(result, query=queries[i])) for i in indices[u]]
+
+        def failed(u, e):
+            if isinstance(e, Overloaded):
+                return results(u, {"error": str(e), "status": e.status})
+            logger.exception("ask_many item failed", extra={"query": unique[u]})
+            self.stage_stats["ask"].incr("errors")
+            return results(u, {"error": f"System error: {str(e)}"})
+
+        plans = [None] * len(unique)
+        vector = []
+        for u,query in enumerate(unique):
+            try:
+                plans[u] = self._prepare_local(query)
+            except Exception as e:
+                yield from failed(u, e)
+                continue
+            if "answer" in plans[u]:
+                yield from results(u, {"answer": plans[u]["answer"]})
+            elif "lexical_hits" in plans[u]:
+                vector.append(u)
+        if vector:
+            try:
+                with self.stage_stats["embed"].timer():
+                    embeddings = self.embedder.embed_queries([unique[u] for u in vector])
+                for u,plan in zip(vector, self._prepare_vector([unique[u] for u in vector], [plans[u] for u in vector], embeddings)):
+                    plans[u] = plan
+                    if "answer" in plan:
+                        yield from results(u, {"answer": plan["answer"]})
+            except Exception as e:
+                for u in vector:
+                    plans[u] = None
+                    yield from failed(u, e)
+
+        todo = [u for u,plan in enumerate(plans) if plan is not None and "context" in plan]
+        if not todo:
+            return
+        concurrency = max(1, concurrency or self.batch_concurrency)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(todo))) as pool:
+            def generate(u):
+                return self._generate_answer(unique[u], plans[u], deadline or self.deadline())
+
+            futures = {pool.submit(generate, u): u for u in todo}
+            for future in as_completed(futures):
+                u = futures[future]
+                try:
+                    yield from results(u, {"answer": future.result()})
+                except Exception as e:
+                    yield from failed(u, e)
+
+    def ask_many(self, queries, concurrency=None, deadline=None):
+        # Same as ask_many_iter, collected in input order
+        answers = [None] * len(queries)
+        with self.stage_stats["ask_many"].timer():
+            for i,result in self.ask_many_iter(queries, concurrency, deadline):
+                answers[i] = result
+        return answers
+
+    def ask_stream(self, query, deadline=None):
+        # Yields (event, data) pairs: retrieval metadata first, then answer tokens as they arrive
+        try:
+            deadline = self.deadline(deadline)
+            plan = self._prepare(query, deadline)
+            prompt, prompt_info = (None, {}) if "answer" in plan else self.assemble_prompt(query, plan["context"])
+            if "answer" in plan:
+                yield from self._stream_answer(query, plan, prompt, prompt_info)
+                return
+            generation_deadline = self._generation_deadline(deadline)
+            # The slot is taken before any event is sent, so a shed request gets the extractive
+            # answer (or a single error event when that is disabled)
+            try:
+                self.admission.acquire(generation_deadline)
+            except Overloaded as e:
+                plan = dict(plan, answer=self._fallback(query, plan, e), fallback=True)
+                yield from self._stream_answer(query, plan, prompt, prompt_info)
+                return
+            try:
+                yield from self._stream_answer(query, plan, prompt, prompt_info, generation_deadline)
+            finally:
+                self.admission.release()
+        except Overloaded as e:
+            yield "error", {"message": str(e), "status": e.status, "retry_after": e.retry_after}
+        except Exception as e:
+            logger.exception("ask_stream failed")
+            self.stage_stats["ask"].incr("errors")
+            yield "error", {"message": f"System error: {str(e)}"}
+
+    def _stream_answer(self, query, plan, prompt, prompt_info, deadline=None):
+        chunk_ids = plan.get("chunk_ids", [])
+        yield "context", {
+            "collection": plan.get("collection"),
+            "collections": plan.get("collections", []),
+            "cached": "answer" in plan and not plan.get("facts", False) and not plan.get("fallback", False),
+            "facts": plan.get("facts", False),
+            "fallback": plan.get("fallback", False),
+            "chunk_ids": chunk_ids,
+            "sources": sorted({self.manifest[cid]["source"] for cid in chunk_ids if cid in self.manifest}),
+            "titles": [self.manifest[cid].get("title") for cid in chunk_ids if cid in self.manifest],
+            "prompt_tokens": prompt_info.get("prompt_tokens")
+        }
+        if "answer" in plan:
+            yield "token", {"text": plan["answer"]}
+            yield "done", {}
+            return
+        pieces = []
+        try:
+            with self.stage_stats["generate"].timer():
+                for piece in self.generate_stream(prompt, deadline=deadline):
+                    pieces.append(piece)
+                    yield "token", {"text": piece}
+        except Exception as e:
+            # Only a stream that never started can be replaced by the extractive answer
+            if pieces:
+                raise
+            yield "token", {"text": self._fallback(query, plan, e), "fallback": True}
+            yield "done", {}
+            return
+        response = "".join(pieces).strip()
+        self.answer_cache.put(query, plan["collection"], plan["embedding"], response, chunk_ids)
+        yield "done", {}
+
 # Create Flask app to serve the assistant
 app = Flask(__name__)
+# Number of proxies in front of the app that append to X-Forwarded-For (1 on Render); only
+# the hops they added are trusted, so request.remote_addr is the real client address
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "1"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 CORS(app,origins=["https://thapargptweb.onrender.com"],supports_credentials=True,headers=["Content-Type"])
 # CORS(app)
 
 
 
 assistant = None
+
+
+class Warmup:
+    # Builds the one ThaparAssistant of this process in a background thread and records how far
+    # it got, so /ready can hold traffic back until the index is loaded
+    RETRY_AFTER_FAILURE = 30
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.phase = "idle"
+        self.info = {}
+        self.error = None
+        self.started = None
+        self.failed_at = None
+        self.phase_started = None
+        self.phases = []
+
+    def start(self):
+        with self.lock:
+            if assistant is not None:
+                return
+            if self.thread is not None and (self.failed_at is None or time.monotonic() - self.failed_at < self.RETRY_AFTER_FAILURE):
+                return
+            self.started = self.phase_started = time.monotonic()
+            self.phase, self.info, self.error, self.failed_at, self.phases = "starting", {}, None, None, []
+            self.thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self.thread.start()
+
+    def progress(self, phase, **info):
+        now = time.monotonic()
+        with self.lock:
+            self.phases.append({"phase": self.phase, "seconds": round(now - self.phase_started, 3)})
+            self.phase, self.info, self.phase_started = phase, info, now
+        logger.info("Warm-up progress", extra={"phase": phase, **info})
+
+    def _run(self):
+        global assistant
+        try:
+            built = ThaparAssistant(progress=self.progress)
+        except Exception as e:
+            logger.exception("Warm-up failed")
+            with self.lock:
+                self.phase, self.error, self.failed_at = "failed", str(e), time.monotonic()
+            return
+        assistant = built
+        self.progress("ready")
+
+    def status(self):
+        with self.lock:
+            return {
+                "ready": assistant is not None,
+                "phase": "ready" if assistant is not None else self.phase,
+                "info": self.info,
+                "error": self.error,
+                "elapsed_s": round(time.monotonic() - self.started, 3) if self.started else None,
+                "phases": list(self.phases)
+            }
+
+
+warmup = Warmup()
+
+
+# Per-client token buckets in front of every question endpoint; RATE_LIMIT_PER_MIN=0 disables
+rate_limiter = RateLimiter(
+    rate=float(os.getenv("RATE_LIMIT_PER_MIN", "60")) / 60,
+    burst=float(os.getenv("RATE_LIMIT_BURST", "20"))
+)
+
+
+def client_id():
+    # Address seen by the trusted proxy (see TRUSTED_PROXIES); client-supplied hops are ignored
+    return request.remote_addr or "unknown"
+
+
+def shed(e):
+    return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
+
+def rate_limited(cost=1):
+    client = client_id()
+    if rate_limiter.allow(client, cost):
+        return None
+    return shed(RateLimited("Rate limit exceeded, slow down", retry_after=rate_limiter.retry_after(client, cost)))
+
+
+def requested_deadline():
+    # Optional per-request budget in seconds; ASK_DEADLINE still caps it
+    value = request.json.get('deadline')
+    if value is None:
+        return None, None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        return None, (jsonify({'error': 'deadline must be a positive number of seconds'}), 400)
+    return value, None
+
+
+def not_ready():
+    warmup.start()
+    return jsonify(dict(warmup.status(), error=warmup.error or 'Assistant is warming up')), 503, {'Retry-After': '5'}
+
+
+@app.before_request
+def start_warmup():
+    # Cheap once started; covers `flask run` and servers without the gunicorn hook
+    if assistant is None:
+        warmup.start()
+
 @app.route('/api/ask', methods=['POST','OPTIONS'])
 def api_ask():
-    global assistant
+    if request.method == "OPTIONS":
+        return jsonify({'status': 'ok'})
 
     if assistant is None:
-        print("🌀 Initializing ThaparAssistant on first request...")
-        assistant = ThaparAssistant()
+        return not_ready()
+
+    if not request.json or 'query' not in request.json:
+        return jsonify({'error': 'Query parameter is required'}), 400
+
+    limited = rate_limited()
+    if limited:
+        return limited
+
+    deadline, error = requested_deadline()
+    if error:
+        return error
+
+    query = request.json['query']
+    try:
+        response = assistant.ask(query, deadline)
+    except Overloaded as e:
+        return shed(e)
+
+    return response
 
+@app.route('/api/ask/stream', methods=['POST','OPTIONS'])
+def api_ask_stream():
     if request.method == "OPTIONS":
         return jsonify({'status': 'ok'})
 
+    if assistant is None:
+        return not_ready()
+
     if not request.json or 'query' not in request.json:
         return jsonify({'error': 'Query parameter is required'}), 400
 
+    limited = rate_limited()
+    if limited:
+        return limited
+
+    deadline, error = requested_deadline()
+    if error:
+        return error
+
     query = request.json['query']
-    response = assistant.ask(query)
 
-    return response
+    def events():
+        for event, data in assistant.ask_stream(query, deadline):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/api/ask/batch', methods=['POST','OPTIONS'])
+def api_ask_batch():
+    if request.method == "OPTIONS":
+        return jsonify({'status': 'ok'})
+
+    if assistant is None:
+        return not_ready()
+
+    if not request.json or not isinstance(request.json.get('queries'), list):
+        return jsonify({'error': 'queries must be a list of strings'}), 400
+
+    queries = request.json['queries']
+    if len(queries) > assistant.batch_max_queries:
+        return jsonify({'error': f'At most {assistant.batch_max_queries} queries per batch'}), 413
+
+    limited = rate_limited(cost=len(queries))
+    if limited:
+        return limited
+
+    deadline, error = requested_deadline()
+    if error:
+        return error
+
+    if not request.json.get('stream'):
+        return jsonify({'results': assistant.ask_many(queries, deadline=deadline)})
+
+    # One JSON object per line, in completion order; "index" points back into `queries`
+    def lines():
+        for i, result in assistant.ask_many_iter(queries, deadline=deadline):
+            yield json.dumps(dict(result, index=i)) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+@app.route('/api/stats', methods=['GET'])
+def api_stats():
+    if assistant is None:
+        return jsonify({'status': 'not initialized'})
+    return jsonify({
+        'query_embedding_cache': assistant.embedder.query_cache.stats(),
+        'answer_cache': assistant.answer_cache.stats(),
+        'llm': assistant.llm_status(),
+        'single_flight': assistant.single_flight.stats(),
+        'admission': assistant.admission.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'stages': {name: stats.snapshot() for name, stats in assistant.stage_stats.items()},
+        'populate': {name: stats.snapshot() for name, stats in assistant.populate_stats.items()}
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Under gunicorn every worker writes its own samples; aggregate them per scrape
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    status = warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
 
 @app.route('/', methods=['GET'])
 def health_check():
+    # Liveness only; use /ready to know whether questions can be answered yet
     return jsonify({
         'status': 'ok',
-        'message': 'Thapar Assistant API is running'
+        'message': 'Thapar Assistant API is running',
+        'ready': assistant is not None
     })
     
-print("✅ End of ThaparGpt2.py script reached.")
+logger.debug("ThaparGpt2.py loaded")
 
 
 # def start_ngrok():
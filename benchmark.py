@@ -0,0 +1,317 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+# Offline benchmark for ThaparAssistant. Cohere and Groq are replaced by deterministic local
+# stand-ins with configurable latency, so runs need no API keys and are comparable over time.
+#
+#   python benchmark.py --synthetic 2000 --asks 300 --clients 8 --output benchmark_results.jsonl
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUERIES = [
+    "MCA fees",
+    "What is the total fee for M.Tech?",
+    "hostel fee for 2 sharing AC",
+    "Which hostel is cheapest for 3 sharing?",
+    "Who is the warden of Amritam Hall?",
+    "mess fee",
+    "Tell me about the Adventure Club",
+    "What does the Creative Computing Society do?",
+    "When is Saturnalia held?",
+    "Which cultural fest happens in February?",
+    "MCA placement record",
+    "highest package for MBA",
+    "Top recruiters for M.Tech CSE",
+    "What is the MCA syllabus for semester 2?",
+    "What are the electives in M.Tech Mechanical?",
+    "What is the grading scale for MCA?",
+    "Scholarships for M.Tech students without GATE",
+    "Is there a merit scholarship for MSc?",
+    "Which clubs are there for dancing?",
+    "How do I contact the Entrepreneurship Development Cell?",
+    "What is the minimum CGPA requirement?",
+    "Are hostels air conditioned?",
+    "What amenities does Tejas Hall have?",
+    "hello",
+    "How is campus life at Thapar?",
+]
+
+SYNTHETIC_WORDS = (
+    "research workshop seminar lab project internship faculty advisor society club event festival "
+    "hostel mess room sharing fee tuition scholarship placement recruiter package semester elective "
+    "grading evaluation quiz thesis campus library sports music dance drama coding robotics"
+).split()
+
+
+class LocalCohereClient:
+    # Stand-in for cohere.Client: hashed bag-of-words vectors, so similar texts get similar vectors
+    def __init__(self, api_key=None, latency=0.05, per_text=0.0005, dim=384):
+        self.latency = latency
+        self.per_text = per_text
+        self.dim = dim
+        self.requests = 0
+        self.texts = 0
+        self.lock = threading.Lock()
+
+    def _vector(self, txt):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for tok in re.findall(r"[a-z0-9]+", txt.lower()):
+            digest = hashlib.md5(tok.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vec[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed(self, texts, model, input_type):
+        time.sleep(self.latency + self.per_text * len(texts))
+        with self.lock:
+            self.requests += 1
+            self.texts += len(texts)
+        return SimpleNamespace(embeddings=[self._vector(t) for t in texts])
+
+
+class LocalGroqResponse:
+    def __init__(self, content, stream, token_latency):
+        self.status_code = 200
+        self.headers = {}
+        self.content = content
+        self.stream = stream
+        self.token_latency = token_latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        time.sleep(self.token_latency * len(self.content.split()))
+        return {"choices": [{"message": {"content": self.content}}]}
+
+    def iter_lines(self, decode_unicode=True):
+        for word in self.content.split():
+            time.sleep(self.token_latency)
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": word + " "}}]})
+        yield "data: [DONE]"
+
+
+class LocalGroqSession:
+    # Stand-in for the pooled requests.Session used by Mixtral
+    def __init__(self, latency=0.3, token_latency=0.002, answer_tokens=60):
+        self.headers = {}
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None, stream=False):
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+        question = json["messages"][-1]["content"].rsplit("User Question:", 1)[-1].strip()
+        words = (f"Offline answer for {question}: " + "lorem " * self.answer_tokens).split()
+        return LocalGroqResponse(" ".join(words[:self.answer_tokens]), stream, self.token_latency)
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+    return {
+        "count": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 2),
+        "p50_ms": round(1000 * pick(50), 2),
+        "p95_ms": round(1000 * pick(95), 2),
+        "p99_ms": round(1000 * pick(99), 2),
+    }
+
+
+def build_corpus(workdir, synthetic, seed):
+    data_dir = os.path.join(workdir, "Structured_Data")
+    shutil.copytree(os.path.join(REPO_DIR, "Structured_Data"), data_dir)
+    rng = random.Random(seed)
+    per_file = 500
+    for start in range(0, synthetic, per_file):
+        with open(os.path.join(data_dir, f"synthetic_{start // per_file}.txt"), "w", encoding="utf-8") as f:
+            for i in range(start, min(start + per_file, synthetic)):
+                f.write(f"### Synthetic Record {i}\n")
+                for field in ("Objective", "Details", "Contact"):
+                    f.write(f"- {field}: {' '.join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(8, 30)))}\n")
+                f.write("\n")
+    return data_dir
+
+
+def make_assistant(T, args, cohere_client):
+    class BenchAssistant(T.ThaparAssistant):
+        def populate_db(self):
+            start = time.perf_counter()
+            super().populate_db()
+            self.populate_seconds = time.perf_counter() - start
+
+    # ThaparGpt2 imports cohere lazily, so a stub module is enough
+    sys.modules["cohere"] = SimpleNamespace(Client=lambda api_key: cohere_client)
+    start = time.perf_counter()
+    assistant = BenchAssistant()
+    elapsed = time.perf_counter() - start
+    assistant.session = LocalGroqSession(args.llm_latency, args.token_latency, args.answer_tokens)
+    if args.no_answer_cache:
+        assistant.answer_cache.max_size = 0
+    return assistant, elapsed
+
+
+def run_asks(assistant, args, rng):
+    latencies = []
+    for _ in range(args.asks):
+        query = rng.choice(QUERIES)
+        start = time.perf_counter()
+        assistant.ask(query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_http(T, assistant, args, rng):
+    import requests
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    T.assistant = assistant
+    server = make_server("127.0.0.1", 0, T.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/ask"
+    plans = [[rng.choice(QUERIES) for _ in range(args.requests_per_client)] for _ in range(args.clients)]
+
+    def client(queries):
+        session = requests.Session()
+        latencies, errors = [], 0
+        for query in queries:
+            start = time.perf_counter()
+            try:
+                response = session.post(url, json={"query": query}, timeout=60)
+                if response.status_code != 200:
+                    errors += 1
+            except requests.RequestException:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(client, plans))
+    wall = time.perf_counter() - start
+    server.shutdown()
+    latencies = [lat for lats, _ in results for lat in lats]
+    return {
+        "clients": args.clients,
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "wall_s": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency": percentiles(latencies),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ThaparAssistant benchmark with local Cohere/Groq stand-ins")
+    parser.add_argument("--synthetic", type=int, default=0, help="extra synthetic ### records added to the corpus")
+    parser.add_argument("--asks", type=int, default=200, help="sequential ask() calls to time")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent HTTP clients against the Flask app (0 to skip)")
+    parser.add_argument("--requests-per-client", type=int, default=25)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per stand-in embed request")
+    parser.add_argument("--embed-per-text", type=float, default=0.0005, help="extra seconds per text in an embed request")
+    parser.add_argument("--embed-dim", type=int, default=384)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds before the stand-in LLM responds")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="seconds per generated token")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=os.getenv("VECTOR_BACKEND", "chroma"), help="vector store backend")
+    parser.add_argument("--vector-dtype", choices=["float32", "float16"], default="float32", help="matrix dtype for the numpy backend")
+    parser.add_argument("--no-answer-cache", action="store_true", help="disable the answer cache so every ask reaches the LLM")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="JSON lines file; one line is appended per run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="thapar-bench-")
+    try:
+        data_dir = build_corpus(workdir, args.synthetic, args.seed)
+        os.environ["THAPAR_DATA_DIR"] = data_dir
+        os.environ["THAPAR_INDEX_DIR"] = os.path.join(workdir, "index")
+        os.environ["COHERE_API_KEY"] = "offline-benchmark"
+        os.environ["VECTOR_BACKEND"] = args.backend
+        os.environ["VECTOR_DTYPE"] = args.vector_dtype
+        # Every simulated client shares one address; measure throughput, not the per-client limit
+        os.environ["RATE_LIMIT_PER_MIN"] = "0"
+        sys.path.insert(0, REPO_DIR)
+        import ThaparGpt2 as T
+
+        cohere_client = LocalCohereClient(latency=args.embed_latency, per_text=args.embed_per_text, dim=args.embed_dim)
+        assistant, cold_start = make_assistant(T, args, cohere_client)
+        cold_populate = assistant.populate_seconds
+        texts_embedded = cohere_client.texts
+        warm, warm_start = make_assistant(T, args, cohere_client)
+
+        rng = random.Random(args.seed)
+        ask_latencies = run_asks(assistant, args, rng)
+        results = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "config": vars(args),
+            "corpus": {"files": len(os.listdir(data_dir)), "chunks": len(assistant.manifest)},
+            "cold_start_s": round(cold_start, 3),
+            "warm_start_s": round(warm_start, 3),
+            "populate_db": {
+                "cold_s": round(cold_populate, 3),
+                "chunks_embedded": texts_embedded,
+                "embed_requests": cohere_client.requests,
+                "chunks_per_s": round(texts_embedded / cold_populate, 1) if cold_populate else None,
+                "warm_s": round(warm.populate_seconds, 3),
+            },
+            "ask": {
+                "latency": percentiles(ask_latencies),
+                "stages": {name: stats.snapshot() for name, stats in assistant.stage_stats.items()},
+                "llm": assistant.llm_status(),
+                "answer_cache": assistant.answer_cache.stats(),
+                "query_embedding_cache": assistant.embedder.query_cache.stats(),
+            },
+        }
+        if args.clients > 0:
+            results["http"] = run_http(T, assistant, args, rng)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(results) + "\n")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
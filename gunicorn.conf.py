@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+# Build the vector index once in the master, before any worker forks. Workers memory map the
+# same vectors.bin read-only, so adding workers does not add copies of the vectors or re-embeds.
+#
+#   gunicorn -c gunicorn.conf.py ThaparGpt2:app
+
+os.environ.setdefault("VECTOR_BACKEND", "numpy")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+preload_app = True
+
+
+def on_starting(server):
+    # In a child process so the master never holds sockets, sqlite handles or threads across fork
+    env = {k: v for k, v in os.environ.items() if k != "THAPAR_INDEX_READONLY"}
+    result = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest.py"), "--index-only"], env=env)
+    if result.returncode == 0:
+        os.environ["THAPAR_INDEX_READONLY"] = "1"
+    else:
+        # Workers fall back to building (and writing) the index themselves
+        server.log.error("Index build failed with exit code %s; workers will build their own", result.returncode)
+
+
+def post_worker_init(worker):
+    # Start loading the prebuilt index as soon as the worker exists; /ready answers 503 until done
+    import ThaparGpt2
+    ThaparGpt2.warmup.start()
+
+
+def child_exit(server, worker):
+    # Drop a dead worker's live gauges (slots in use, queue depth) from the multiprocess metrics
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
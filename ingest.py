@@ -0,0 +1,359 @@
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Raw_Data -> Structured_Data conversion (replaces DataPreProcessing.ipynb).
+# Each source is streamed row by row into "### title" records, sources are converted in
+# parallel, and a source whose raw files hash the same as last run is skipped entirely.
+#
+#   python ingest.py                 # convert changed sources only
+#   python ingest.py --index         # ...and embed the changed chunks into the vector index
+#   python ingest.py --index-only    # index build step only (gunicorn runs this before forking)
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = ".ingest_state.json"
+# Bump when a converter's output format changes so every source is rebuilt once
+CONVERTER_VERSION = 1
+
+MISSING = {"", "-", "nan", "none", "n/a"}
+
+
+def clean(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, datetime.time):
+        return value.strftime("%H:%M")
+    value = re.sub(r"[\s\u200b\xa0]+", " ", str(value)).strip().lstrip(":").strip()
+    return None if value.lower() in MISSING else value
+
+
+def xlsx_rows(path):
+    # read_only mode streams rows instead of loading the whole workbook
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [clean(name) for name in next(rows, [])]
+        for row in rows:
+            values = [clean(value) for value in row]
+            if any(values):
+                yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def field(key, value, indent=0):
+    return f"{'  ' * indent}- {key}: {value}\n" if value else ""
+
+
+def fields(row, columns):
+    return "".join(field(label, row.get(column)) for label,column in columns)
+
+
+def hostel_key(name):
+    # "Hostel B", "Hostel-B" and "hostel b" all refer to the same block
+    return re.sub(r"[^a-z0-9]", "", (name or "").lower())
+
+
+def ordinal(n):
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def convert_hostel_info(info_path, fees_path):
+    fees = {}
+    for row in xlsx_rows(fees_path):
+        sharing = [(col.title(), row[col]) for col in row if col and "sharing" in col.lower() and row[col]]
+        fees[hostel_key(row.get("Hostel Name"))] = sharing
+    rooms = [("4 Sharing", "4 sharing"), ("3 Sharing", "3 Sharing"), ("2 Sharing", "2 share Rooms"), ("Single", "Single Rooms Availability")]
+    amenities = [("Wi-Fi", "Wi-Fi"), ("Lift", "Lift"), ("Laundry", "Laundry Service"), ("Late Night Mess", "Late Night Mess")]
+    for row in xlsx_rows(info_path):
+        previous = row.get("Hostel Previous Name")
+        record = f"### {row['Hostel Name']}" + (f" (Previously: {previous})" if previous else "") + "\n"
+        record += field("Residence Type", row.get("Type of Hostel"))
+        record += field("Capacity", row.get("Capacity of Hostel"))
+        record += field("AC Room Availability", row.get("AC Room Availability"))
+        if row.get("Mess Fees"):
+            record += field("Mess Fees", f"₹{row['Mess Fees']} per semester")
+        contact = ", ".join(f"{label}: {row[col]}" for label,col in (("Contact", "Contact of Warden"), ("Email", "Email of Warden")) if row.get(col))
+        if row.get("Warden Name"):
+            record += field("Warden", row["Warden Name"] + (f" ({contact})" if contact else ""))
+        record += field("Assistant Warden", row.get("Assistant Warden"))
+        caretakers = ""
+        for shift,name_col,phone_col in (("Day", "Day Caretaker", "Day Caretaker Number"), ("Night", "Night Caretaker Name", "Night Caretaker Number")):
+            if row.get(name_col):
+                phone = row.get(phone_col)
+                caretakers += field(shift, row[name_col].rstrip(",") + (f" (Phone: {phone})" if phone else ""), indent=1)
+        if caretakers:
+            record += "- Caretakers:\n" + caretakers
+        record += field("Email", row.get("Email ID Caretaker"))
+        record += field("Reception", row.get("Reception Contact Number"))
+        available = [label for label,col in rooms if (row.get(col) or "").lower() == "available"]
+        record += field("Room Types Available", ", ".join(available))
+        room_fees = fees.get(hostel_key(previous), [])
+        if room_fees:
+            record += "- Room Fees:\n" + "".join(field(sharing, f"₹{amount} per semester", indent=1) for sharing,amount in room_fees)
+        record += field("Amenities", ", ".join(label for label,col in amenities if (row.get(col) or "").lower() == "available"))
+        record += field("Floors", row.get("Number of Floors(including ground floor)"))
+        record += field("Late Entry", row.get("Late Entry Timings"))
+        yield record
+
+
+def convert_hostel_fees(path):
+    # Two header rows: "2Sharing-AC" style columns, then the washroom type of each column.
+    # Several columns share a name (one per washroom type); the first filled one wins.
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = csv.reader(f)
+        header = next(rows)
+        next(rows, None)
+        merged = {}
+        for row in rows:
+            name = clean(row[0])
+            if not name:
+                continue
+            grid = merged.setdefault(name, {})
+            for column,value in zip(header[1:], row[1:]):
+                value = clean(value)
+                if value:
+                    sharing, _, kind = column.partition("Sharing-")
+                    grid.setdefault((sharing, kind), value)
+    for name,grid in merged.items():
+        record = f"### {name}\n- Room Types and Washroom Details:\n"
+        for sharing in sorted({sharing for sharing,_ in grid}):
+            prices = "".join(field(kind, grid[(sharing, kind)], indent=2) for kind in ("Non-AC", "AC") if (sharing, kind) in grid)
+            record += f"  - {sharing} Sharing:\n" + prices
+        yield record
+
+
+def convert_course_fees(path):
+    columns = [
+        ("Total Fees", "Total Programme Fee in Rs."),
+        ("Amount to be paid each semester in Rs. (Equal Installment)", "Amount to be paid each semester in Rs. (Equal Installment)"),
+        ("Tuition Fee in each semester", "Tuition Fee in each semester"),
+        ("Development Fee in each semester", "Development Fee in each semester"),
+        ("Other Charges in each semester", "Other Charges in each semester")
+    ]
+    for row in xlsx_rows(path):
+        record = f"### {row['Programme']}\n" + field("Number of Semester", row.get("No. of Semesters (Normal Duration)"))
+        record += "".join(field(label, f"Rs. {row[col]}") for label,col in columns if row.get(col))
+        yield record
+
+
+def convert_scholarships(path):
+    seen = {}
+    columns = [
+        ("Scholarship Type", "Scholarship Type"),
+        ("Eligibility", "Eligibility"),
+        ("Amount of Scholarship", "Amount"),
+        ("Continuation Criteria", "Continuation Criteria"),
+        ("Special Notes", "Special Notes")
+    ]
+    for row in xlsx_rows(path):
+        program = row["Program"]
+        seen[program] = seen.get(program, 0) + 1
+        yield f"### {program} - {ordinal(seen[program])} Scholarship\n" + fields(row, columns)
+
+
+def convert_student_bodies(name_column):
+    columns = [("Objective", "Objective"), ("Faculty Advisors", "Faculty Advisor(s)"), ("Contact Email", "Contact Email")]
+
+    def convert(path):
+        for row in xlsx_rows(path):
+            if row.get(name_column):
+                yield f"### {row[name_column]}\n" + fields(row, columns)
+    return convert
+
+
+def convert_events(path):
+    for row in xlsx_rows(path):
+        if row.get("Cultural Event"):
+            yield f"### {row['Cultural Event']}\n" + field("Month", row.get("Month"))
+
+
+def convert_markdown(path):
+    # Already hand-written records; normalise "**Heading**" lines and typography only
+    replacements = [("–", " to "), ("~", "approximate "), ("**", "")]
+    record = ""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip()
+            if re.fullmatch(r"\*\*[^*]+\*\*", line):
+                line = f"- {line.strip('*')}"
+            for old,new in replacements:
+                line = line.replace(old, new)
+            if line.startswith("###") and record.strip():
+                yield record
+                record = ""
+            if line or record:
+                record += line + "\n"
+    if record.strip():
+        yield record
+
+
+# output file -> (converter, raw inputs); output names are what DataLoader/collectionForFile expect
+SOURCES = {
+    "Hostel_info.txt": (convert_hostel_info, ["Hostel_Info.xlsx", "Hostel_fees.xlsx"]),
+    "Hostel_fees.txt": (convert_hostel_fees, ["HostelFees.csv"]),
+    "course_fee.txt": (convert_course_fees, ["PG_Courses_Fees.xlsx"]),
+    "scholarships.txt": (convert_scholarships, ["scholarships.xlsx"]),
+    "clubs_thapar.txt": (convert_student_bodies("Club Name"), ["clubs_thapar.xlsx"]),
+    "Thapar_Societies.txt": (convert_student_bodies("Society Name"), ["Societies_Thapar.xlsx"]),
+    "TIET_Events.txt": (convert_events, ["TIET_Cultural_Events.xlsx"]),
+    "Pg_Program_Structure.txt": (convert_markdown, ["Postgraduate_Program_Structure.txt"]),
+    "Placement_Record.txt": (convert_markdown, ["thapar_pg_placement_records_yearwise.txt"]),
+}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_hashes(path):
+    # Records as split on "###"; VectorDB.chunkData may cut long ones into several chunks, and
+    # populate_db logs how many of those were actually re-embedded
+    try:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            chunks = [chunk.strip() for chunk in f.read().split("###") if chunk.strip()]
+    except OSError:
+        return set()
+    return {hashlib.sha256(chunk.encode("utf-8")).hexdigest() for chunk in chunks}
+
+
+def build(output, raw_dir, out_dir):
+    # Runs in a worker process: stream records into a temp file, then swap it in
+    convert, inputs = SOURCES[output]
+    target = os.path.join(out_dir, output)
+    tmp_path = f"{target}.tmp{os.getpid()}"
+    start = time.perf_counter()
+    before = record_hashes(target)
+    records = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in convert(*(os.path.join(raw_dir, name) for name in inputs)):
+            f.write(record.rstrip("\n") + "\n\n")
+            records += 1
+    os.replace(tmp_path, target)
+    after = record_hashes(target)
+    return {
+        "records": records,
+        "records_added": len(after - before),
+        "records_removed": len(before - after),
+        "output_hash": file_hash(target),
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+
+def load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return state.get("sources", {}) if state.get("version") == CONVERTER_VERSION else {}
+
+
+def save_state(path, sources):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": CONVERTER_VERSION, "sources": sources}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan(raw_dir, out_dir, state, only, force):
+    todo, hashes = [], {}
+    for output,(_, inputs) in SOURCES.items():
+        if only and output not in only and not set(inputs) & set(only):
+            continue
+        try:
+            hashes[output] = {name: file_hash(os.path.join(raw_dir, name)) for name in inputs}
+        except OSError as e:
+            print(f"[ingest] skipping {output}: {e}", file=sys.stderr)
+            continue
+        target = os.path.join(out_dir, output)
+        previous = state.get(output, {})
+        unchanged = (
+            previous.get("inputs") == hashes[output]
+            and os.path.exists(target)
+            and previous.get("output_hash") == file_hash(target)
+        )
+        if force or not unchanged:
+            todo.append(output)
+    return todo, hashes
+
+
+def update_index(out_dir):
+    # Chunk ids are content addressed, so populate_db only embeds the chunks that changed
+    os.environ["THAPAR_DATA_DIR"] = out_dir
+    sys.path.insert(0, REPO_DIR)
+    from ThaparGpt2 import VectorDB
+    db = VectorDB()
+    db.populate_db()
+    return db.populate_stats["total"].snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Raw_Data sources into ### record files, skipping unchanged sources")
+    parser.add_argument("--raw-dir", default=os.path.join(REPO_DIR, "Raw_Data"))
+    parser.add_argument("--out-dir", default=os.getenv("THAPAR_DATA_DIR", os.path.join(REPO_DIR, "Structured_Data")))
+    parser.add_argument("--workers", type=int, default=min(len(SOURCES), os.cpu_count() or 1))
+    parser.add_argument("--only", nargs="*", default=[], help="output or raw file names to limit the run to")
+    parser.add_argument("--force", action="store_true", help="rebuild sources even if their raw files are unchanged")
+    parser.add_argument("--index", action="store_true", help="embed changed chunks into the vector index afterwards")
+    parser.add_argument("--index-only", action="store_true", help="skip conversion and only bring the vector index up to date")
+    args = parser.parse_args()
+
+    if args.index_only:
+        print(f"[ingest] index: {json.dumps(update_index(args.out_dir))}")
+        return 0
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    state_path = os.path.join(args.out_dir, STATE_FILE)
+    state = load_state(state_path)
+    start = time.perf_counter()
+    todo, hashes = plan(args.raw_dir, args.out_dir, state, set(args.only), args.force)
+
+    results, failed = {}, {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(todo)))) as pool:
+            futures = {pool.submit(build, output, args.raw_dir, args.out_dir): output for output in todo}
+            for future in as_completed(futures):
+                output = futures[future]
+                try:
+                    results[output] = future.result()
+                except Exception as e:
+                    failed[output] = str(e)
+                    continue
+                state[output] = {"inputs": hashes[output], "output_hash": results[output]["output_hash"]}
+                # Saved after every source so an interrupted run keeps its progress
+                save_state(state_path, state)
+
+    for output in SOURCES:
+        if output in results:
+            r = results[output]
+            print(f"[ingest] {output}: {r['records']} records, +{r['records_added']}/-{r['records_removed']} changed in {r['seconds']}s")
+        elif output in failed:
+            print(f"[ingest] {output}: FAILED {failed[output]}", file=sys.stderr)
+        elif output in hashes:
+            print(f"[ingest] {output}: unchanged")
+    print(f"[ingest] {len(results)} of {len(hashes)} sources rebuilt in {time.perf_counter() - start:.2f}s")
+
+    # Run even when nothing was rebuilt here: a previous run may have stopped before indexing
+    if args.index:
+        print(f"[ingest] index: {json.dumps(update_index(args.out_dir))}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())